@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+调度策略对比: 每种策略在相同的随机种子与到达场景下以离散事件模式运行(无界面),
+输出吞吐量, 平均/p95/最大等待时间, 最大队列长度以及每次调度决策的 cpu 时间
+
+    python bench_policies.py --duration 3600 --seeds 1 2 3
+"""
+
+import argparse
+
+from scheduler_server import Controller, EventClock, TRAFFIC_MANAGERS
+
+# 4 个路口各自每秒到达的车辆数, 约 1/3 的车辆右转不需要排队.
+# 定时信号每 3.3s 一个相位放行两条队列各 15~16 辆车, 通行能力约 9.4 辆/s;
+# saturated 中需要排队的车辆为 4.0 * 4 * 2/3 = 10.7 辆/s, 超过定时信号的通行能力
+SCENARIOS = {"light": [0.2, 0.2, 0.2, 0.2],
+             "balanced": [1.0, 1.0, 1.0, 1.0],
+             "asymmetric": [2.0, 0.3, 2.0, 0.3],
+             "saturated": [4.0, 4.0, 4.0, 4.0]}
+
+COLUMNS = ["throughput", "mean_delay", "p95_delay", "max_delay", "max_queue", "cpu_per_decision"]
+
+
+def run_policy(policy, rates, duration, seed) -> dict:
+    controller = Controller(None, clock=EventClock(), policy=policy)
+    return controller.simulate(duration, arrival_rate=rates, seed=seed, verbose=False)
+
+
+# 多个随机种子的结果取平均, 最大等待时间与最大队列长度取最大值
+def run_scenario(policy, rates, duration, seeds) -> dict:
+    results = [run_policy(policy, rates, duration, seed) for seed in seeds]
+    res = {key: sum(r[key] for r in results) / len(results) for key in COLUMNS}
+    res["max_delay"] = max(r["max_delay"] for r in results)
+    res["max_queue"] = max(r["max_queue"] for r in results)
+    return res
+
+
+def main(policies, scenarios, duration, seeds):
+    print("duration: {}s, seeds: {}".format(duration, list(seeds)))
+    print("{:<12} {:<12} {:>12} {:>12} {:>12} {:>12} {:>10} {:>16}".format(
+        "scenario", "policy", "cars/s", "mean delay", "p95 delay", "max delay", "max queue", "cpu/decision"))
+    for scenario in scenarios:
+        for policy in policies:
+            res = run_scenario(policy, SCENARIOS[scenario], duration, seeds)
+            print("{:<12} {:<12} {:>12.3f} {:>11.2f}s {:>11.2f}s {:>11.2f}s {:>10} {:>14.1f}us".format(
+                scenario, policy, res["throughput"], res["mean_delay"], res["p95_delay"], res["max_delay"],
+                res["max_queue"], res["cpu_per_decision"] * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--policies', nargs='+', default=sorted(TRAFFIC_MANAGERS.keys()),
+                        choices=sorted(TRAFFIC_MANAGERS.keys()))
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS.keys()), choices=list(SCENARIOS.keys()))
+    parser.add_argument('--duration', type=float, default=3600)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2, 3])
+    args = parser.parse_args()
+
+    main(args.policies, args.scenarios, args.duration, args.seeds)
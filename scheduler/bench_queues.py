@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+TrafficQueues 的性能测试, 不需要界面
+
+    python bench_queues.py contention --producers 4 --duration 3
+    python bench_queues.py view
+    python bench_queues.py memory
+    python bench_queues.py wakeup
+"""
+
+import argparse
+import random
+import threading
+import time
+import tracemalloc
+
+from intersection import QUEUE_MOVEMENTS
+from scheduler_server import CarInfo, Controller, SmartTrafficManager, TrafficQueues
+
+
+def _new_car(i):
+    line_from, line_to = QUEUE_MOVEMENTS[i % len(QUEUE_MOVEMENTS)]
+    return CarInfo(i, line_from, line_to, time.time(), 1)
+
+
+def _insert_rate(traffic_queues, producers, duration) -> float:
+    counters = [0] * producers
+    stop = threading.Event()
+
+    def produce(k):
+        i = k
+        while not stop.is_set():
+            traffic_queues.insertCar(_new_car(i))
+            i += producers
+            counters[k] += 1
+
+    threads = [threading.Thread(target=produce, args=(k,)) for k in range(producers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(counters) / duration
+
+
+# 管理线程满负荷运行(不等待, 持续读取并弹出队列)时的插入速率.
+# single_lock 为 True 时 8 条队列共用一把锁, 对比改为每条队列一把锁之前的情况
+# (TrafficQueues 从不同时持有两把队列锁, 共用一把锁不会死锁)
+def _busy_insert_rate(producers, duration, single_lock=False) -> tuple:
+    controller = Controller(None)
+    if single_lock:
+        controller.traffic_queues.locks = [threading.Lock()] * 8
+    manager = SmartTrafficManager(controller)
+    manager.verbose = False
+    manager.pass_time = 0
+    manager.append_time = 0
+    manager.daemon = True
+    manager.start()
+    rate = _insert_rate(controller.traffic_queues, producers, duration)
+    departed = manager.total_counter
+    # 等待管理线程放行剩余车辆后挂起, 不影响之后的测量
+    while sum(controller.traffic_queues.getWaittingQueueSize8()):
+        time.sleep(0.01)
+    return rate, departed
+
+
+# 多个线程持续插入车辆, 对比管理线程空闲与满负荷运行时的插入速率, 以及单锁与每条队列一把锁
+def bench_contention(producers=4, duration=3.0):
+    controller = Controller(None)
+    idle_rate = _insert_rate(controller.traffic_queues, producers, duration)
+    single_rate, single_departed = _busy_insert_rate(producers, duration, single_lock=True)
+    busy_rate, busy_departed = _busy_insert_rate(producers, duration)
+
+    print("producers: {}, duration: {}s".format(producers, duration))
+    print("insert rate, manager idle:                  {:.0f} cars/s".format(idle_rate))
+    print("insert rate, manager running, single lock:  {:.0f} cars/s ({} cars departed)".format(
+        single_rate, single_departed))
+    print("insert rate, manager running, per-queue:    {:.0f} cars/s ({} cars departed)".format(
+        busy_rate, busy_departed))
+
+
+# 不同队列深度下, 管理线程每次调度读取队列的耗时: 全量复制 getCopy 与 O(1) 视图 getQueueState
+def bench_view(depths=(10, 1000, 100000), repeat=200):
+    print("{:>8} {:>14} {:>18}".format("depth", "getCopy(us)", "getQueueState(us)"))
+    for depth in depths:
+        traffic_queues = TrafficQueues()
+        traffic_queues.insertCars([_new_car(i) for i in range(depth * 8)])
+        start = time.perf_counter()
+        for i in range(repeat):
+            traffic_queues.getCopy()
+        copy_cost = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for i in range(repeat):
+            traffic_queues.getQueueState()
+        view_cost = (time.perf_counter() - start) / repeat
+        print("{:>8} {:>14.1f} {:>18.1f}".format(depth, copy_cost * 1e6, view_cost * 1e6))
+
+
+# 改为 __slots__ 之前的 CarInfo, 字段为 request.form 中的原始字符串, 仅用于内存对比
+class _DictCarInfo:
+    Id = -1
+    LineFrom = -1
+    LineTo = -1
+    TimeStart = 0.0
+    Weight = -1
+    client_host = ""
+    client_port = -1
+
+
+def _new_dict_car(i):
+    line_from, line_to = QUEUE_MOVEMENTS[i % len(QUEUE_MOVEMENTS)]
+    car = _DictCarInfo()
+    car.Id = str(i)
+    car.LineFrom = str(line_from)
+    car.LineTo = str(line_to)
+    car.TimeStart = time.time()
+    car.Weight = str(i % 11)
+    return car
+
+
+def _bytes_per_car(new_car, cars) -> float:
+    traffic_queues = TrafficQueues()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(cars):
+        car = new_car(i)
+        traffic_queues.q[i % 8].append(car)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / cars
+
+
+# 队列中每辆车占用的内存(字节), 包括车辆对象, 字段对象以及 deque 中的位置
+def bench_memory(cars=200000):
+    print("queued cars: {}".format(cars))
+    print("dict CarInfo, string fields: {:.0f} bytes/car".format(_bytes_per_car(_new_dict_car, cars)))
+    print("slots CarInfo, typed fields: {:.0f} bytes/car".format(_bytes_per_car(_new_car, cars)))
+
+
+# 改为事件唤醒之前, 队列为空时管理器每隔 RATE 秒轮询一次
+POLL_INTERVAL = 0.1
+
+
+class _PollingTrafficQueues(TrafficQueues):
+    """对照组: 队列为空时不等待通知, 而是 sleep POLL_INTERVAL 后重新检查"""
+
+    def waitForCars(self, choice=None, timeout=None):
+        return POLL_INTERVAL if timeout is None else min(POLL_INTERVAL, timeout)
+
+
+def _wakeup_delay(samples, idle, polling=False) -> tuple:
+    controller = Controller(None)
+    if polling:
+        controller.traffic_queues = _PollingTrafficQueues(metrics=controller.metrics)
+    manager = SmartTrafficManager(controller)
+    manager.verbose = False
+    manager.daemon = True
+    manager.start()
+    for i in range(samples):
+        time.sleep(idle + random.random() * 0.1)  # 随机错开, 避免与轮询周期同步
+        controller.traffic_queues.insertCar(_new_car(i))
+    time.sleep(idle)
+    return manager.total_counter, manager.mean_delay(), manager.max_delay
+
+
+# 路口空闲一段时间后到达一辆车, 从插入到被放行的延迟, 对比轮询与事件唤醒
+def bench_wakeup(samples=10, idle=0.7):
+    print("samples: {}, idle: {}s".format(samples, idle))
+    for name, polling in (("polling every {}s".format(POLL_INTERVAL), True), ("event wake-up", False)):
+        departed, mean_delay, max_delay = _wakeup_delay(samples, idle, polling=polling)
+        print("{:<20} idle to first departure: mean {:.2f}ms, max {:.2f}ms ({} cars)".format(
+            name, mean_delay * 1000, max_delay * 1000, departed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='bench')
+    contention = sub.add_parser('contention', help="insert rate while a manager is running")
+    contention.add_argument('--producers', type=int, default=4)
+    contention.add_argument('--duration', type=float, default=3.0)
+    sub.add_parser('view', help="per-decision queue read cost versus queue depth")
+    memory = sub.add_parser('memory', help="bytes per queued car")
+    memory.add_argument('--cars', type=int, default=200000)
+    wakeup = sub.add_parser('wakeup', help="latency from idle to first departure")
+    wakeup.add_argument('--samples', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.bench == 'contention':
+        bench_contention(producers=args.producers, duration=args.duration)
+    elif args.bench == 'view':
+        bench_view()
+    elif args.bench == 'memory':
+        bench_memory(cars=args.cars)
+    elif args.bench == 'wakeup':
+        bench_wakeup(samples=args.samples)
+    else:
+        parser.print_help()
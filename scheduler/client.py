@@ -2,8 +2,13 @@
 # -*-coding:utf-8-*-
 
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import random
+import json
+import argparse
+import threading
+import queue
 
 
 class CarInfo:
@@ -22,21 +27,116 @@ def NewCarInfo():
             "weight": -1}
 
 
+class LoadGenerator(object):
+    """
+    开环压力测试: 每个路口按泊松过程以给定速率产生车辆, 由 concurrency 个线程
+    通过各自的 keep-alive 连接发送到 /register, 发送不等待上一个请求的响应.
+    延迟从计划发送时间开始计算, 服务端变慢时排队的时间也计入延迟
+    """
+
+    def __init__(self, host, port, rates, concurrency=16, duration=10.0, seed=None):
+        self.url = 'http://{}:{}/register'.format(host, port)
+        self.rates = rates  # 4 个路口各自每秒到达的车辆数
+        self.concurrency = concurrency
+        self.duration = duration
+        self.random = random.Random(seed)
+        self.tasks = queue.Queue()
+        self.latencies = []  # 每个线程只 append, list.append 是原子操作
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def _produce(self, start):
+        total_rate = sum(self.rates)
+        scheduled = start
+        car_id = 0
+        while True:
+            scheduled += self.random.expovariate(total_rate)
+            if scheduled >= start + self.duration:
+                break
+            line_from = self.random.choices(range(4), weights=self.rates)[0]
+            car = {"id": car_id,
+                   "line_from": line_from,
+                   "line_to": (line_from + self.random.randint(1, 3)) % 4,
+                   "request_time": scheduled,
+                   "weight": self.random.randint(0, 10)}
+            car_id += 1
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.tasks.put((scheduled, car))
+        for i in range(self.concurrency):
+            self.tasks.put(None)
+
+    def _consume(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            scheduled, car = task
+            try:
+                resp = session.post(self.url, data=car)
+                ok = resp.status_code == 200 and resp.text == "success"
+                resp.close()
+            except Exception:
+                ok = False
+            if ok:
+                self.latencies.append(time.time() - scheduled)
+            else:
+                with self.lock:
+                    self.errors += 1
+        session.close()
+
+    def run(self) -> dict:
+        workers = [threading.Thread(target=self._consume) for i in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        start = time.time()
+        self._produce(start)
+        for worker in workers:
+            worker.join()
+        cost = time.time() - start
+        return self._report(cost)
+
+    def _report(self, cost) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(int(p / 100.0 * len(latencies)), len(latencies) - 1)]
+
+        return {"offered_rate": sum(self.rates),
+                "achieved_rate": len(latencies) / cost,
+                "requests": len(latencies),
+                "errors": self.errors,
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+                "max": latencies[-1] if latencies else 0.0}
+
+
 class Client:
     def __init__(self):
         self.host = '127.0.0.1'
         self.port = 8989
 
+    def _random_car(self):
+        req = NewCarInfo()
+        req['id'] = random.randint(0, 10000)
+        req['line_from'] = random.randint(0, 3)
+        req['line_to'] = random.randint(0, 3)
+        if req['line_to'] == req['line_from']:
+            req['line_to'] = (req['line_to']+1) % 4
+        req['request_time'] = time.time()
+        req['weight'] = random.randint(0,10)
+        return req
+
     def start(self):
         while True:
-            req = NewCarInfo()
-            req['id'] = random.randint(0, 10000)
-            req['line_from'] = random.randint(0, 3)
-            req['line_to'] = random.randint(0, 3)
-            if req['line_to'] == req['line_from']:
-                req['line_to'] = (req['line_to']+1) % 8
-            req['request_time'] = time.time()
-            req['weight'] = random.randint(0,10)
+            req = self._random_car()
             try:
                 print("post: id:{}, line_from: {}, line_to: {}, request_time: {}, weight: {}".format(req['id'],
                                                                                                      req['line_from'],
@@ -50,6 +150,39 @@ class Client:
                 print(e)
             time.sleep(random.random()/5)
 
+    # 对比 /register 单车注册与 /register_batch 批量注册的吞吐量(车辆数/s)
+    def bench_register(self, total=2000, batch_size=100):
+        url = 'http://{}:{}'.format(self.host, self.port)
+        cars = [self._random_car() for i in range(total)]
+        session = requests.Session()
+
+        start = time.time()
+        for car in cars:
+            session.post(url + '/register', data=car).close()
+        single_cost = time.time() - start
+
+        start = time.time()
+        for i in range(0, total, batch_size):
+            body = "\n".join(json.dumps(car) for car in cars[i:i + batch_size])
+            session.post(url + '/register_batch', data=body).close()
+        batch_cost = time.time() - start
+        session.close()
+
+        print("single: {} cars in {:.2f}s, {:.0f} cars/s".format(total, single_cost, total / single_cost))
+        print("batch({}): {} cars in {:.2f}s, {:.0f} cars/s".format(batch_size, total, batch_cost, total / batch_cost))
+        print("speedup: {:.1f}x".format(single_cost / batch_cost))
+
+    # 开环压测 /register, rate 为每个路口每秒到达的车辆数
+    def load(self, rate, concurrency=16, duration=10.0, seed=None):
+        generator = LoadGenerator(self.host, self.port, [rate] * 4,
+                                  concurrency=concurrency, duration=duration, seed=seed)
+        res = generator.run()
+        print("offered: {offered_rate:.0f} req/s, achieved: {achieved_rate:.0f} req/s, "
+              "ok: {requests}, errors: {errors}".format(**res))
+        print("latency p50: {:.1f}ms, p95: {:.1f}ms, p99: {:.1f}ms, max: {:.1f}ms".format(
+            res['p50'] * 1000, res['p95'] * 1000, res['p99'] * 1000, res['max'] * 1000))
+        return res
+
     def test_pygame_show(self):
         while True:
             queue_size_list4 = {"0":random.randint(0,4),
@@ -73,6 +206,22 @@ class Client:
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bench', action='store_true', help="compare /register and /register_batch throughput")
+    parser.add_argument('--total', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--load', type=float, default=None,
+                        help="open-loop load test: Poisson arrivals per second per approach")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
     with Client() as client:
-        client.start()
+        if args.bench:
+            client.bench_register(total=args.total, batch_size=args.batch)
+        elif args.load is not None:
+            client.load(args.load, concurrency=args.concurrency, duration=args.duration, seed=args.seed)
+        else:
+            client.start()
         # client.test_pygame_show()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+调度事件日志: 车辆到达(进入等待队列), 相位开始/结束(绿灯/黄灯), 车辆离开
+定长二进制记录, 只追加写入. 调度线程只把记录追加到内存缓冲区,
+由后台线程批量写入文件, 每隔 flush_interval 秒或缓冲区超过 batch_bytes 时写一次
+
+文件格式: 16 字节文件头(MAGIC + 记录长度), 之后是连续的 24 字节小端记录:
+    time     float64  事件时间(s), 实时模式为 unix 时间, 离散事件模式为模拟时间
+    car_id   int64    车辆 id, 相位事件为 -1
+    kind     uint8    ARRIVAL / PHASE_START / PHASE_END / DEPARTURE
+    queue    int8     队列编号, 相位开始为放行的第一条队列, 相位结束为 -1
+    aux      int16    到达: 车辆权重; 相位开始: 放行的第二条队列(没有为 -1); 其他为 0
+    value    float32  离开: 等待时间(s); 其他为 0
+
+读取时把文件 mmap 到内存, 不需要一次读入, 可以直接转换为 numpy 结构化数组做离线分析
+
+    python event_log.py run.evlog
+"""
+
+import argparse
+import mmap
+import struct
+import threading
+import time
+from collections import namedtuple
+
+MAGIC = b"SCHEDLOG"
+HEADER = struct.Struct('<8sI4x')
+RECORD = struct.Struct('<dqBbhf')
+
+ARRIVAL = 1
+PHASE_START = 2
+PHASE_END = 3
+DEPARTURE = 4
+
+# car_id 与 aux(车辆权重)字段能表示的范围, web 接口拒绝超出范围的车辆, 其他来源写入时截断
+CAR_ID_RANGE = (-(1 << 63), (1 << 63) - 1)
+WEIGHT_RANGE = (-(1 << 15), (1 << 15) - 1)
+
+
+def _clamp(value, value_range):
+    return min(max(value, value_range[0]), value_range[1])
+
+Event = namedtuple('Event', ['time', 'car_id', 'kind', 'queue', 'aux', 'value'])
+
+
+class EventLogWriter(object):
+    def __init__(self, path, flush_interval=1.0, batch_bytes=1 << 20):
+        self.path = path
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, RECORD.size))
+        self.flush_interval = flush_interval
+        self.batch_bytes = batch_bytes
+        self.cond = threading.Condition(threading.Lock())
+        self.buffer = bytearray()
+        self.total_counter = 0
+        self.dropped = 0  # 关闭之后丢弃的记录数
+        self.closed = False
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    # 在锁外打包, 锁内只追加字节. 关闭之后后台线程已经退出, 之后的记录被丢弃, 不再缓冲
+    def _append(self, records: bytes, n: int):
+        with self.cond:
+            if self.closed:
+                self.dropped += n
+                return
+            self.buffer += records
+            self.total_counter += n
+            if len(self.buffer) >= self.batch_bytes:
+                self.cond.notify()
+
+    # cars 为进入 queue 的 CarInfo, 到达时间为 TimeStart.
+    # 在调度/web 线程中调用, 不能抛出异常, id 与权重超出字段范围时截断
+    def arrivals(self, cars, queue):
+        self._append(b"".join(RECORD.pack(car.TimeStart, _clamp(car.Id, CAR_ID_RANGE), ARRIVAL, queue,
+                                          _clamp(car.Weight, WEIGHT_RANGE), 0.0)
+                              for car in cars), len(cars))
+
+    # 参数与 on_traffic_light_changed 相同, 没有队列(None)表示绿灯结束
+    def phase(self, t, *queues):
+        queues = [x for x in queues if x is not None]
+        if not queues:
+            self._append(RECORD.pack(t, -1, PHASE_END, -1, 0, 0.0), 1)
+        else:
+            self._append(RECORD.pack(t, -1, PHASE_START, queues[0], queues[1] if len(queues) > 1 else -1, 0.0), 1)
+
+    # times 为每辆车通过的时间(一次放行多辆车时依次错开)
+    def departures(self, times, cars, queue, delays):
+        self._append(b"".join(RECORD.pack(t, _clamp(car.Id, CAR_ID_RANGE), DEPARTURE, queue, 0, delay)
+                              for t, car, delay in zip(times, cars, delays)), len(cars))
+
+    # 后台线程: 取出缓冲区后在锁外写文件, 调度线程只在追加内存时短暂持有锁
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                if not self.closed and len(self.buffer) < self.batch_bytes:
+                    self.cond.wait(self.flush_interval)
+                data, self.buffer = self.buffer, bytearray()
+                closed = self.closed
+            if data:
+                self.file.write(data)
+                self.file.flush()
+            if closed:
+                break
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        self.file.close()
+
+
+class EventLogReader(object):
+    """以 mmap 读取事件日志, 支持 len(), 下标访问与迭代, 只读取用到的页"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError("not an event log: {}".format(path))
+        # 写入中途退出时最后一条记录可能不完整, 忽略
+        self.count = (len(self.map) - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i) -> Event:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return Event(*RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size))
+
+    def __iter__(self):
+        end = HEADER.size + self.count * RECORD.size
+        with memoryview(self.map) as view, view[HEADER.size:end] as records:
+            for record in RECORD.iter_unpack(records):
+                yield Event(*record)
+
+    # 不复制数据的 numpy 结构化数组视图, 需要 numpy
+    def to_numpy(self):
+        import numpy as np
+        dtype = np.dtype([('time', '<f8'), ('car_id', '<i8'), ('kind', 'u1'), ('queue', 'i1'),
+                          ('aux', '<i2'), ('value', '<f4')])
+        return np.frombuffer(self.map, dtype=dtype, count=self.count, offset=HEADER.size)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def summary(path) -> dict:
+    with EventLogReader(path) as reader:
+        events = reader.to_numpy()
+        departures = events[events['kind'] == DEPARTURE]
+        res = {"events": len(events),
+               "arrivals": int((events['kind'] == ARRIVAL).sum()),
+               "phases": int((events['kind'] == PHASE_START).sum()),
+               "departures": len(departures),
+               "start": float(events['time'][0]) if len(events) else 0.0,
+               "end": float(events['time'][-1]) if len(events) else 0.0,
+               "mean_delay": float(departures['value'].mean()) if len(departures) else 0.0,
+               "max_delay": float(departures['value'].max()) if len(departures) else 0.0,
+               "queue_departures": [int((departures['queue'] == i).sum()) for i in range(8)]}
+        del events, departures  # 关闭 mmap 前释放 numpy 视图
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    start = time.time()
+    res = summary(args.path)
+    print("{events} events from {start:.2f} to {end:.2f}: arrivals: {arrivals}, phases: {phases}, "
+          "departures: {departures}".format(**res))
+    print("mean delay: {mean_delay:.2f}s, max delay: {max_delay:.2f}s".format(**res))
+    print("departures per queue: {}".format(res["queue_departures"]))
+    print("read in {:.2f}s".format(time.time() - start))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+道路映射示意图见 https://s1.ax1x.com/2020/05/27/tAnZaF.jpg
+MOVEMENT_TABLE[line_from][line_to] 为车辆所在等待队列的编号(0~7),
+右转与掉头不与其他车流冲突, 不需要排队, 用负数编码表示
+"""
+RIGHT_TURN = -1
+U_TURN = -2
+INVALID_MOVEMENT = -3
+MOVEMENT_TABLE = [[U_TURN, RIGHT_TURN, 0, 1],
+                  [3, U_TURN, RIGHT_TURN, 2],
+                  [4, 5, U_TURN, RIGHT_TURN],
+                  [RIGHT_TURN, 6, 7, U_TURN]]
+# 等待队列编号 -> (line_from, line_to)
+QUEUE_MOVEMENTS = [(0, 2), (0, 3), (1, 3), (1, 0), (2, 0), (2, 1), (3, 1), (3, 2)]
+
+
+def get_movement(line_from: int, line_to: int) -> int:
+    if 0 <= line_from < 4 and 0 <= line_to < 4:
+        return MOVEMENT_TABLE[line_from][line_to]
+    return INVALID_MOVEMENT
+
+
+def _is_conflict(a: int, b: int) -> bool:
+    (from_a, to_a), (from_b, to_b) = QUEUE_MOVEMENTS[a], QUEUE_MOVEMENTS[b]
+    if a == b or from_a == from_b:
+        return False  # 同一路口的直行与左转可以同时放行
+    if to_a == to_b:
+        return True  # 驶入同一条道路
+    if (from_a - from_b) % 4 == 2:
+        # 对向直行或者对向左转互不冲突, 直行与对向左转冲突
+        return (to_a - from_a) % 4 != (to_b - from_b) % 4
+    return True  # 相邻路口驶来的车流在路口中交叉
+
+
+def _compatible_phases() -> list:
+    # 枚举所有互不冲突的队列集合, 只保留极大集合(不能再加入其他队列)
+    compatible = []
+    for mask in range(1, 1 << 8):
+        queues = [i for i in range(8) if mask >> i & 1]
+        if all(not CONFLICT_MATRIX[a][b] for a in queues for b in queues):
+            compatible.append(mask)
+    maximal = [mask for mask in compatible if not any(other != mask and other & mask == mask for other in compatible)]
+    return [tuple(i for i in range(8) if mask >> i & 1) for mask in maximal]
+
+
+"""
+以下在导入时计算一次, 调度时 O(1) 查询
+CONFLICT_MATRIX[i][j]: 队列 i 与队列 j 同时放行是否冲突
+COMPATIBLE_PHASES: 所有极大的可同时放行的队列集合(相位)
+PHASES_BY_QUEUE[i]: 包含队列 i 的相位
+OPPOSING_PHASES: 对向直行/对向左转组成的 4 个相位, 正好覆盖全部队列一次, 用于固定周期信号
+"""
+CONFLICT_MATRIX = [[_is_conflict(a, b) for b in range(8)] for a in range(8)]
+COMPATIBLE_PHASES = _compatible_phases()
+PHASES_BY_QUEUE = [tuple(phase for phase in COMPATIBLE_PHASES if i in phase) for i in range(8)]
+OPPOSING_PHASES = [phase for phase in COMPATIBLE_PHASES
+                   if len({QUEUE_MOVEMENTS[i][0] for i in phase}) == len(phase)]
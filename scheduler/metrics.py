@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+路口运行指标, 由交通管理线程和 TrafficQueues 增量更新, 每辆车的开销为 O(1)
+通过 WebServer 的 /metrics 接口以 json 输出
+"""
+
+import math
+
+SUB_BUCKET_BITS = 5  # 每个 2 的幂区间内的桶数为 2^(SUB_BUCKET_BITS-1), 相对误差约 3%
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+
+class WaitTimeHistogram(object):
+    """
+    HDR 风格的等待时间直方图, 以毫秒为单位按对数-线性分桶,
+    记录为 O(1), 求分位数与桶数相关而与记录的车辆数无关
+    """
+
+    def __init__(self):
+        self.counts = [0] * SUB_BUCKET_COUNT
+        self.total = 0
+        self.max_value = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (value >> shift) - SUB_BUCKET_HALF
+
+    @staticmethod
+    def _highest_value(index: int) -> int:
+        # 桶内的最大值
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = (index - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+        top = (index - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value = max(int(seconds * 1000), 0)
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.total += 1
+        if value > self.max_value:
+            self.max_value = value
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.max_value = max(self.max_value, other.max_value)
+
+    # 返回第 p 百分位的等待时间(s)
+    def percentile(self, p: float) -> float:
+        if self.total == 0:
+            return 0.0
+        target = max(math.ceil(p / 100.0 * self.total), 1)
+        counter = 0
+        for index, count in enumerate(self.counts):
+            counter += count
+            if counter >= target:
+                return min(self._highest_value(index), self.max_value) / 1000.0
+        return self.max_value / 1000.0
+
+    def summary(self) -> dict:
+        return {"count": self.total,
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "p99": self.percentile(99),
+                "max": self.max_value / 1000.0}
+
+
+class RateCounter(object):
+    """最近 window 秒内每秒的计数, 用于计算到达/离开速率"""
+
+    def __init__(self, window=10):
+        self.window = window
+        self.buckets = [0] * window
+        self.seconds = [-1] * window
+        self.total = 0
+
+    def add(self, now: float, n=1):
+        second = int(now)
+        i = second % self.window
+        if self.seconds[i] != second:
+            self.seconds[i] = second
+            self.buckets[i] = 0
+        self.buckets[i] += n
+        self.total += n
+
+    # 最近 window 个完整秒内的平均速率(次/s)
+    def rate(self, now: float) -> float:
+        second = int(now)
+        counter = 0
+        for i in range(self.window):
+            if second - self.window <= self.seconds[i] < second:
+                counter += self.buckets[i]
+        return counter / self.window
+
+
+class MovementMetrics(object):
+    def __init__(self):
+        self.arrivals = RateCounter()
+        self.departures = RateCounter()
+        self.wait_time = WaitTimeHistogram()
+        self.max_length = 0
+
+
+class TrafficMetrics(object):
+    """
+    每个等待队列单独计数: 到达在该队列的锁内更新, 离开只由管理线程更新, 不需要额外的锁
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.movements = [MovementMetrics() for i in range(8)]
+        self.phase = []  # 当前放行的队列, 空表示黄灯/全红
+
+    def on_arrival(self, queueIndex: int, n=1, length=0):
+        movement = self.movements[queueIndex]
+        movement.arrivals.add(self.clock.now(), n)
+        if length > movement.max_length:
+            movement.max_length = length
+
+    def on_departure(self, queueIndex: int, delays):
+        movement = self.movements[queueIndex]
+        movement.departures.add(self.clock.now(), len(delays))
+        for delay in delays:
+            movement.wait_time.record(delay)
+
+    def set_phase(self, *args):
+        self.phase = [x for x in args if x is not None]
+
+    # 所有队列合并后的等待时间直方图
+    def wait_time(self) -> WaitTimeHistogram:
+        wait_time = WaitTimeHistogram()
+        for movement in self.movements:
+            wait_time.merge(movement.wait_time)
+        return wait_time
+
+    def max_length(self) -> int:
+        return max(movement.max_length for movement in self.movements)
+
+    # 检查点: 各队列的计数器与直方图都是普通对象, 可以直接 pickle
+    def get_state(self) -> dict:
+        return {"movements": self.movements, "phase": self.phase}
+
+    def set_state(self, state: dict):
+        self.movements = state["movements"]
+        self.phase = state["phase"]
+
+    def snapshot(self, queue_sizes: list) -> dict:
+        now = self.clock.now()
+        movements = []
+        for i, movement in enumerate(self.movements):
+            movements.append({"queue": i,
+                              "length": queue_sizes[i],
+                              "arrivals": movement.arrivals.total,
+                              "departures": movement.departures.total,
+                              "arrivals_per_second": movement.arrivals.rate(now),
+                              "departures_per_second": movement.departures.rate(now),
+                              "max_length": movement.max_length,
+                              "wait_time": movement.wait_time.summary()})
+        return {"time": now,
+                "phase": self.phase,
+                "arrivals_per_second": sum(m["arrivals_per_second"] for m in movements),
+                "departures_per_second": sum(m["departures_per_second"] for m in movements),
+                "wait_time": self.wait_time().summary(),
+                "movements": movements}
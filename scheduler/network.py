@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+N x M 网格路网模拟(离散事件模式, 无界面)
+每个路口是一个 Controller, 共用一个 EventClock. 车辆通过路口后沿驶出的道路,
+经过 link_time 秒到达下游路口, 从对向道路驶入并随机选择下一个转向;
+驶出网格边界的车辆完成行程
+
+道路方向: 0 南, 1 东, 2 北, 3 西 (右转为 line_from + 1)
+
+    python network.py --rows 10 --cols 10 --duration 3600 --rate 0.2 --policy pressure
+"""
+
+import argparse
+import random
+import time
+
+from scheduler_server import CarInfo, Controller, EventClock, TRAFFIC_MANAGERS, get_movement
+
+# 沿道路 d 驶出后到达的相邻路口的 (行, 列) 偏移, 行号向南增大
+ROAD_OFFSETS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+
+class GridNetwork(object):
+    def __init__(self, rows, cols, policy="normal", link_time=10.0, seed=None):
+        self.rows = rows
+        self.cols = cols
+        self.link_time = link_time
+        self.clock = EventClock()
+        self.random = random.Random(seed)
+        self.nodes = []
+        for r in range(rows):
+            row = []
+            for c in range(cols):
+                node = Controller(None, clock=self.clock, policy=policy, web=False)
+                node.traffic_manager.verbose = False
+                node.traffic_manager.random.seed(self.random.random())
+                node.on_departure = self._make_departure(r, c)
+                row.append(node)
+            self.nodes.append(row)
+        # 网格边界上朝外的道路, 车辆从这里进入路网
+        self.entries = [(r, c, d) for r in range(rows) for c in range(cols) for d in range(4)
+                        if not self._inside(r + ROAD_OFFSETS[d][0], c + ROAD_OFFSETS[d][1])]
+        self.entry_time = {}  # 车辆 id -> 进入路网的时间
+        self.car_counter = 0
+        self.trip_counter = 0
+        self.total_trip_time = 0.0
+
+    def _inside(self, r, c) -> bool:
+        return 0 <= r < self.rows and 0 <= c < self.cols
+
+    def _make_departure(self, r, c):
+        return lambda cars: self._depart(r, c, cars)
+
+    # 车辆从 (r, c) 路口沿 car.LineTo 驶出
+    def _depart(self, r, c, cars):
+        for car in cars:
+            d = car.LineTo
+            nr, nc = r + ROAD_OFFSETS[d][0], c + ROAD_OFFSETS[d][1]
+            if self._inside(nr, nc):
+                self.clock.schedule(self.link_time, self._arrive, nr, nc, (d + 2) % 4, car)
+            else:
+                self.trip_counter += 1
+                self.total_trip_time += self.clock.now() - self.entry_time.pop(car.Id)
+
+    # 车辆从道路 line_from 驶入 (r, c) 路口, 随机选择直行/左转/右转
+    def _arrive(self, r, c, line_from, car: CarInfo):
+        car.LineFrom = line_from
+        car.LineTo = (line_from + self.random.randint(1, 3)) % 4
+        car.Movement = get_movement(car.LineFrom, car.LineTo)
+        car.TimeStart = self.clock.now()
+        self.nodes[r][c].traffic_queues.insertCar(car)
+        if car.Movement < 0:
+            # 右转不需要排队, 直接驶出
+            self._depart(r, c, [car])
+
+    # 每条入口道路按泊松过程到达, rate 为每条入口道路每秒到达的车辆数
+    def _arrivals(self, rate):
+        total_rate = rate * len(self.entries)
+        while True:
+            yield self.random.expovariate(total_rate)
+            r, c, d = self.random.choice(self.entries)
+            car = CarInfo(self.car_counter, d, d, self.clock.now(), self.random.randint(0, 10))
+            self.car_counter += 1
+            self.entry_time[car.Id] = self.clock.now()
+            self._arrive(r, c, d, car)
+
+    def simulate(self, duration, rate=0.1) -> dict:
+        for row in self.nodes:
+            for node in row:
+                self.clock.process(node.traffic_manager.timed_process())
+        self.clock.process(self._arrivals(rate))
+        start = time.time()
+        self.clock.run(until=self.clock.now() + duration)
+        managers = [node.traffic_manager for row in self.nodes for node in row]
+        departures = sum(m.total_counter for m in managers)
+        return {"intersections": self.rows * self.cols,
+                "duration": duration,
+                "cost": time.time() - start,
+                "events": self.clock.event_counter,
+                "entered": self.car_counter,
+                "trips": self.trip_counter,
+                "in_network": len(self.entry_time),
+                "mean_trip_time": self.total_trip_time / self.trip_counter if self.trip_counter else 0.0,
+                "departures": departures,
+                "mean_delay": sum(m.total_delay for m in managers) / departures if departures else 0.0,
+                "max_delay": max(m.max_delay for m in managers)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--cols', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=3600)
+    parser.add_argument('--rate', type=float, default=0.1, help="arrivals per second per boundary entry")
+    parser.add_argument('--link-time', type=float, default=10.0, help="travel time between intersections (s)")
+    parser.add_argument('--policy', default="normal", choices=sorted(TRAFFIC_MANAGERS.keys()))
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    network = GridNetwork(args.rows, args.cols, policy=args.policy, link_time=args.link_time, seed=args.seed)
+    res = network.simulate(args.duration, rate=args.rate)
+    print("{intersections} intersections, simulated {duration}s in {cost:.2f}s, events: {events}".format(**res))
+    print("entered: {entered}, trips completed: {trips}, in network: {in_network}, "
+          "mean trip time: {mean_trip_time:.1f}s".format(**res))
+    print("intersection departures: {departures}, mean delay: {mean_delay:.2f}s, "
+          "max delay: {max_delay:.2f}s".format(**res))
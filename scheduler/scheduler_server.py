@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 # -*-coding:utf-8-*-
 
-from flask import Flask, request
+from flask import Flask, request, jsonify, Response
 from collections import deque
+import json
+import pickle
 import time
 import threading
 from typing import List
 import random
 import logging
+import argparse
+from collections import namedtuple
+
+from sim_clock import WallClock, EventClock, Signal, Wait
+from metrics import TrafficMetrics
+from event_log import EventLogWriter, CAR_ID_RANGE, WEIGHT_RANGE
+from state_stream import StateStream
+from intersection import (INVALID_MOVEMENT, get_movement,
+                          COMPATIBLE_PHASES, PHASES_BY_QUEUE, OPPOSING_PHASES)
 
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
@@ -25,59 +36,109 @@ YELLOW_DELAY_TIME = 0.3  # 黄灯时间
 STRAIGHT_PASS_TIME = 0.3  # 单车直行通过路口所用时间
 TRUN_LEFT_PASS_TIME = 0.3  # 单车转弯通过路口所用时间
 APPEND_TIME = 0.2  # 多车通过路口时，多余车的用时的增量(也即队列中的车挪动一个车位所用的时间)
-RATE = 0.1  # 路口为空时的循环监听delay
 
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-BLUE = (0, 0, 255)
-YELLOW = (255, 255, 0)
+class CarInfo:
+    # 使用 __slots__ 而不是 __dict__, 长时间拥堵时队列中可能有几十万辆车
+    __slots__ = ('Id', 'LineFrom', 'LineTo', 'TimeStart', 'Weight', 'Movement')
+
+    def __init__(self, Id=-1, LineFrom=-1, LineTo=-1, TimeStart=0.0, Weight=-1):
+        self.Id = Id  # type: int
+        self.LineFrom = LineFrom  # type: int
+        self.LineTo = LineTo  # type: int
+        self.TimeStart = TimeStart  # type: float
+        self.Weight = Weight  # type: int
+        self.Movement = get_movement(LineFrom, LineTo)  # 等待队列编号, 构造时查表一次
+
+    # 由 http 请求中的字段(request.form 或者 json 对象)构造, 字段非法时抛出 ValueError
+    # id 与权重需要在事件日志记录的字段范围内
+    @classmethod
+    def from_record(cls, record, time_start: float):
+        try:
+            car = cls(int(record.get('id')),
+                      int(record.get('line_from')),
+                      int(record.get('line_to')),
+                      time_start,
+                      int(record.get('weight', 0)))
+        except (TypeError, ValueError):
+            raise ValueError("invalid car record: {}".format(record))
+        if car.Movement == INVALID_MOVEMENT:
+            raise ValueError("invalid car movement: {}".format(record))
+        if not (CAR_ID_RANGE[0] <= car.Id <= CAR_ID_RANGE[1] and WEIGHT_RANGE[0] <= car.Weight <= WEIGHT_RANGE[1]):
+            raise ValueError("car id or weight out of range: {}".format(record))
+        return car
 
 
-class CarInfo:
-    Id = -1
-    LineFrom = -1
-    LineTo = -1
-    TimeStart = 0.0
-    Weight = -1
-    client_host = ""
-    client_port = -1
+# 队列的轻量视图: 长度, 版本号(每次插入/弹出加一), 队首车辆的入队时间(空队列为 None), 队列中车辆权重之和
+QueueState = namedtuple('QueueState', ['length', 'version', 'head_time', 'weight'])
 
 
 class TrafficQueues:
-    def __init__(self):
-        self.q = [deque() for i in range(8)]
-        """
-        道路映射示意图见 https://s1.ax1x.com/2020/05/27/tAnZaF.jpg
-        """
-        self.lock = threading.Lock()
-        self.hash = {"02": 0,
-                     "03": 1,
-                     "13": 2,
-                     "10": 3,
-                     "20": 4,
-                     "21": 5,
-                     "31": 6,
-                     "32": 7}
+    def __init__(self, metrics=None):
+        self.q = [deque() for i in range(8)]  # 队列编号见 intersection.MOVEMENT_TABLE
+        self.metrics = metrics  # type: TrafficMetrics
+        # 每个队列一把锁, web 线程插入与管理线程读取/弹出不同队列时互不阻塞
+        self.locks = [threading.Lock() for i in range(8)]
+        # 随插入/弹出增量维护, 调度时不需要复制队列
+        self.versions = [0] * 8
+        self.weights = [0] * 8
+        self.arrival = Signal()  # 有车辆插入时唤醒等待中的交通管理器
+        self.event_log = None  # type: EventLogWriter
 
     def insertCar(self, carInfo: CarInfo) -> bool:
-        queueIndex = self._getQueueIndex(carInfo)
-        if queueIndex == -1:
+        queueIndex = carInfo.Movement
+        if queueIndex < 0:
             # print("Car {}: no need to wait, passing".format(carInfo.Id))
             return True
 
+        lock = self.locks[queueIndex]
         try:
-            self.lock.acquire()
+            lock.acquire()
             self.q[queueIndex].append(carInfo)
+            self.versions[queueIndex] += 1
+            self.weights[queueIndex] += carInfo.Weight
+            if self.metrics is not None:
+                self.metrics.on_arrival(queueIndex, 1, len(self.q[queueIndex]))
         except Exception as e:
             print(e)
             return False
         finally:
-            self.lock.release()
+            lock.release()
+        self.arrival.notify()
+        if self.event_log is not None:
+            self.event_log.arrivals([carInfo], queueIndex)
         # print("insert car: [id:{}, from:{}, to:{}] to queue {}".format(carInfo.Id, carInfo.LineFrom, carInfo.LineTo, queueIndex))
         return True
 
+    # 批量插入, 每个涉及的队列只获取一次锁, 返回每辆车的插入结果
+    def insertCars(self, carInfos: List[CarInfo]) -> List[bool]:
+        groups = [[] for i in range(8)]
+        for car in carInfos:
+            if car.Movement >= 0:
+                groups[car.Movement].append(car)
+        res = [True] * len(carInfos)
+        for queueIndex, cars in enumerate(groups):
+            if not cars:
+                continue
+            lock = self.locks[queueIndex]
+            try:
+                lock.acquire()
+                self.q[queueIndex].extend(cars)
+                self.versions[queueIndex] += len(cars)
+                self.weights[queueIndex] += sum(car.Weight for car in cars)
+                if self.metrics is not None:
+                    self.metrics.on_arrival(queueIndex, len(cars), len(self.q[queueIndex]))
+            except Exception as e:
+                print(e)
+                return [False] * len(carInfos)
+            finally:
+                lock.release()
+        self.arrival.notify()
+        if self.event_log is not None:
+            for queueIndex, cars in enumerate(groups):
+                if cars:
+                    self.event_log.arrivals(cars, queueIndex)
+        return res
+
     # # 返回4个路口等待队列的长度
     # def getWaittingQueueSize4(self):
     #     wait_0 = len(self.q[0])+len(self.q[1])
@@ -90,31 +151,50 @@ class TrafficQueues:
     def getWaittingQueueSize8(self):
         return [len(self.q[i]) for i in range(8)]
 
+    # O(1) 获取队列状态, 代价与队列长度无关
+    def getQueueState(self, choice=None) -> List[QueueState]:
+        if choice is None:
+            choice = range(8)
+        res = []
+        for i in choice:
+            queue = self.q[i]
+            lock = self.locks[i]
+            lock.acquire()
+            try:
+                head_time = queue[0].TimeStart if queue else None
+                res.append(QueueState(len(queue), self.versions[i], head_time, self.weights[i]))
+            finally:
+                lock.release()
+        return res
+
+    # 返回一个 Wait 对象, 交通管理器 yield 它以等待 choice 中任一队列有车, 代替轮询
+    def waitForCars(self, choice=None, timeout=None) -> Wait:
+        if choice is None:
+            choice = range(8)
+        queues = [self.q[i] for i in choice]
+        return Wait(self.arrival, lambda: any(queues), timeout)
+
     def getCopy(self, choice=None):
         if choice is None:
             return self._getFullCopy()
         return self._getSelectedCopy(choice=choice)
 
     def _getFullCopy(self) -> list:
-        try:
-            self.lock.acquire()
-            res = [x.copy() for x in self.q]
-        except Exception as e:
-            print("Cannot copy traffic queues: ", e)
-            exit(1)
-        finally:
-            self.lock.release()
-        return res
+        return self._getSelectedCopy(choice=range(8))
 
+    # 逐个队列在各自的锁内复制
     def _getSelectedCopy(self, choice: dict) -> list:
-        try:
-            self.lock.acquire()
-            res = [self.q[i].copy() for i in choice]
-        except Exception as e:
-            print("Cannot copy traffic queues: ", e)
-            exit(1)
-        finally:
-            self.lock.release()
+        res = []
+        for i in choice:
+            lock = self.locks[i]
+            try:
+                lock.acquire()
+                res.append(self.q[i].copy())
+            except Exception as e:
+                print("Cannot copy traffic queues: ", e)
+                exit(1)
+            finally:
+                lock.release()
         return res
 
     def getSizesStr(self) -> str:
@@ -129,35 +209,127 @@ class TrafficQueues:
                         len(self.q[7]), )
 
     def shrinkQueue(self, queueIndex: int, length: int):
+        self.popCars(queueIndex, length)
+
+    # 一次弹出队首的 length 辆车(不足时弹出全部)并返回, 用于统计每辆车的等待时间
+    def popCars(self, queueIndex: int, length: int) -> List[CarInfo]:
         if length <= 0:
-            return
+            return []
+        lock = self.locks[queueIndex]
         try:
-            self.lock.acquire()
-            for i in range(length):
-                self.q[queueIndex].popleft()
+            lock.acquire()
+            queue = self.q[queueIndex]
+            if length >= len(queue):
+                cars = list(queue)
+                queue.clear()
+            else:
+                popleft = queue.popleft
+                cars = [popleft() for i in range(length)]
+            self.versions[queueIndex] += len(cars)
+            self.weights[queueIndex] -= sum(car.Weight for car in cars)
         except Exception as e:
             print("shrink queue error: ", e)
             exit(1)
         finally:
-            self.lock.release()
+            lock.release()
+        return cars
+
+    # 检查点: 每条队列保存为 (Id, LineFrom, LineTo, TimeStart, Weight) 元组的列表
+    def getState(self) -> dict:
+        q = []
+        for i in range(8):
+            with self.locks[i]:
+                q.append([(car.Id, car.LineFrom, car.LineTo, car.TimeStart, car.Weight) for car in self.q[i]])
+        return {"q": q, "versions": list(self.versions), "weights": list(self.weights)}
 
-    def _getQueueIndex(self, carInfo: CarInfo) -> int:
-        lineFrom = carInfo.LineFrom
-        lineTo = carInfo.LineTo
-        key = str(lineFrom) + str(lineTo)
-        if not key in self.hash.keys():
-            return -1
-        return self.hash.get(key)
+    def setState(self, state: dict):
+        for i in range(8):
+            with self.locks[i]:
+                self.q[i] = deque(CarInfo(*fields) for fields in state["q"][i])
+        self.versions = list(state["versions"])
+        self.weights = list(state["weights"])
 
 
 class TrafficManager(object):
+    # 检查点中保存的属性. 主循环每次 yield 之后都回到循环开始处, 循环之间的状态都保存在这些属性中,
+    # 恢复时重新创建主循环并在 resume_at 时刻开始执行即可, 等待条件时在恢复时立即重新进入循环并挂起(不计为决策)
+    CHECKPOINT_FIELDS = ('total_counter', 'total_delay', 'max_delay', 'decisions', 'decision_time', 'resume_at')
+
     def __init__(self, controller):
         self.controller = controller  # type: Controller
         self.traffic_queues = self.controller.traffic_queues  # type: TrafficQueues
+        self.clock = self.controller.clock  # type: WallClock
         self.total_counter = 0
+        self.total_delay = 0.0  # 已通过车辆的等待时间之和
+        self.max_delay = 0.0
+        self.decisions = 0  # 调度决策(主循环每次恢复执行)的次数
+        self.decision_time = 0.0  # 调度决策所用的 cpu 时间(s)
+        self.random = random.Random()
+        self.verbose = True
+        self.resume_at = None  # 主循环下一次恢复执行的时间, 等待条件(Wait)时为 None
 
     def run(self):
-        pass
+        # 实时模式下在当前线程中阻塞执行, 离散事件模式下仅注册到事件时钟
+        self.clock.process(self.timed_process())
+
+    # 主循环, 每次 yield 需要等待的时长(s)
+    def process(self):
+        return
+        yield
+
+    # 统计每次调度决策所用的 cpu 时间.
+    # resumed 为 True 时主循环是从检查点恢复的等待条件: 第一次执行只是重新进入循环并再次挂起, 不计为决策
+    def timed_process(self, resumed=False):
+        gen = self.process()
+        while True:
+            start = time.process_time()
+            try:
+                delay = next(gen)
+            except StopIteration:
+                return
+            if resumed:
+                resumed = False
+            else:
+                self.decision_time += time.process_time() - start
+                self.decisions += 1
+            self.resume_at = None if isinstance(delay, Wait) else self.clock.now() + max(delay, 0)
+            yield delay
+
+    def get_state(self) -> dict:
+        state = {name: getattr(self, name) for name in self.CHECKPOINT_FIELDS}
+        state["random"] = self.random.getstate()
+        return state
+
+    def set_state(self, state: dict):
+        for name in self.CHECKPOINT_FIELDS:
+            setattr(self, name, state.get(name, getattr(self, name)))  # 旧检查点中没有的属性保持初始值
+        self.random.setstate(state["random"])
+
+    # 放行队首的 length 辆车并统计等待时间.
+    # 一次放行多辆车时(batch_pass_time 不为 None), 第 k 辆车在 now + batch_pass_time + k * append_time 通过,
+    # 与每隔 append_time 放行一辆车的策略按相同的方式计算等待时间
+    def _release(self, queueIndex: int, length: int, batch_pass_time=None) -> int:
+        cars = self.traffic_queues.popCars(queueIndex, length)
+        now = self.clock.now()
+        if batch_pass_time is None:
+            times = [now] * len(cars)
+        else:
+            times = [now + batch_pass_time + k * self.append_time for k in range(len(cars))]
+        delays = [t - car.TimeStart for t, car in zip(times, cars)]
+        for delay in delays:
+            self.total_delay += delay
+            if delay > self.max_delay:
+                self.max_delay = delay
+        self.total_counter += len(cars)
+        if cars:
+            self.controller.metrics.on_departure(queueIndex, delays)
+            if self.controller.event_log is not None:
+                self.controller.event_log.departures(times, cars, queueIndex, delays)
+            self.controller.on_cars_departed(cars)
+        return len(cars)
+
+    def mean_delay(self) -> float:
+        return self.total_delay / self.total_counter if self.total_counter else 0.0
 
     def _on_queue_changed(self):
         self.controller.on_traffic_queue_changed()
@@ -182,18 +354,21 @@ class SmartTrafficManager(threading.Thread, TrafficManager):
         self.total_counter = 0
         self.pass_time = STRAIGHT_PASS_TIME
         self.append_time = APPEND_TIME
-        self.rate = RATE
         self.yellow_delay_time = YELLOW_DELAY_TIME
 
     def run(self):
-        print("Smart Traffic Manager Run.")
+        TrafficManager.run(self)
+
+    def process(self):
+        if self.verbose:
+            print("Smart Traffic Manager Run.")
         while True:
-            curQueueList = self.traffic_queues.getCopy()
-            priQueueIndex, carNumbers = self._getPriorityQueue(curQueueList)
+            curQueueStates = self.traffic_queues.getQueueState()
+            priQueueIndex, carNumbers = self._getPriorityQueue(curQueueStates)
 
-            # 所有队列均为空
+            # 所有队列均为空, 等待车辆到达
             if priQueueIndex == -1:
-                time.sleep(0.1)
+                yield self.traffic_queues.waitForCars()
                 continue
 
             """
@@ -202,94 +377,359 @@ class SmartTrafficManager(threading.Thread, TrafficManager):
             # 车辆通过路口后需要从其原先队列中删除
             # --- 此处为根据车辆数目等待一定的时长
             """
-            print("[SMART TRAFFIC MANAGER] let traffic queue {} pass {} cars".format(priQueueIndex, carNumbers))
-            self._on_traffic_light_changed(priQueueIndex)
-            self.traffic_queues.shrinkQueue(priQueueIndex, carNumbers)  # 通知priQueueIndex队列中的前carNumber辆车通过路口
+            phase = self._getReleasePhase(priQueueIndex, curQueueStates)
+            if self.verbose:
+                print("[SMART TRAFFIC MANAGER] let traffic queue {} pass {} cars".format(
+                    phase if len(phase) > 1 else priQueueIndex, carNumbers))
+            self._on_traffic_light_changed(*phase)
+            for i in phase:
+                self._release(i, carNumbers, self.pass_time)  # 通知队列中的前carNumber辆车通过路口
             self._on_queue_changed()
-            print(self.traffic_queues.getSizesStr())
-            time.sleep(self.pass_time + carNumbers * self.append_time)  # 等待车辆通过路口
+            if self.verbose:
+                print(self.traffic_queues.getSizesStr())
+            yield self.pass_time + carNumbers * self.append_time  # 等待车辆通过路口
 
     # TODO:: 主算法部分：通过路口等待队列(队列中的车辆数/车辆权重/各自初始如对时间)+当前时间
     # 获取优先级最高的队列，以及可以通过路口的车辆数
-    def _getPriorityQueue(self, curQueueList: List[deque]):
+    def _getPriorityQueue(self, curQueueStates: List[QueueState]):
         queue_index, car_nums = -1, 0
-        for i in range(len(curQueueList)):
-            if len(curQueueList[i]) > car_nums:
+        for i in range(len(curQueueStates)):
+            if curQueueStates[i].length > car_nums:
                 queue_index = i
-                car_nums = len(curQueueList[i])
+                car_nums = curQueueStates[i].length
         if queue_index == -1:
             return -1, -1
-        return queue_index, random.randint(1, car_nums)
+        return queue_index, self.random.randint(1, car_nums)
+
+    # 本次放行的队列, 只放行优先级最高的队列
+    def _getReleasePhase(self, queueIndex: int, curQueueStates: List[QueueState]) -> tuple:
+        return (queueIndex,)
 
     def _onShutdown(self):
         return
 
 
+class SmartPhaseTrafficManager(SmartTrafficManager):
+    """与 SmartTrafficManager 相同地选择队列与车辆数, 但同时放行与该队列不冲突且车辆最多的相位中的其他队列"""
+
+    def _getReleasePhase(self, queueIndex: int, curQueueStates: List[QueueState]) -> tuple:
+        best_phase, best_cars = (queueIndex,), -1
+        for phase in PHASES_BY_QUEUE[queueIndex]:
+            cars = sum(curQueueStates[i].length for i in phase)
+            if cars > best_cars:
+                best_phase, best_cars = phase, cars
+        return best_phase
+
+
 class NormalTrafficManager(threading.Thread, TrafficManager):
+    CHECKPOINT_FIELDS = TrafficManager.CHECKPOINT_FIELDS + ('cur_traffic_index', 'green_end_time')
+
     def __init__(self, controller):
         threading.Thread.__init__(self)
         TrafficManager.__init__(self, controller)
-        self.traffic_lights = [(0, 4), (1, 5), (2, 6), (3, 7)]
+        self.traffic_lights = OPPOSING_PHASES
         self.cur_traffic_index = 0
+        self.green_end_time = None  # 当前绿灯结束的时间, 黄灯期间为 None
         self.last_time = 0  # 上一次变化的时间
         self.total_counter = 0
         self.cur_counter = 0
         self.green_delay_time = GREEN_DELAY_TIME
         self.yellow_delay_time = YELLOW_DELAY_TIME
-        self.rate = RATE  # 频率，ms
         self.append_time = APPEND_TIME
 
     def run(self):
-        print("Normal Traffic Manager Run.")
+        TrafficManager.run(self)
+
+    def process(self):
+        if self.verbose:
+            print("Normal Traffic Manager Run.")
         while True:
-            self.cur_traffic_index = (self.cur_traffic_index + 1) % len(self.traffic_lights)
+            if self.green_end_time is None:
+                self.cur_traffic_index = (self.cur_traffic_index + 1) % len(self.traffic_lights)
+                line0, line1 = self.traffic_lights[self.cur_traffic_index]
+                self.green_end_time = self.clock.now() + self.green_delay_time
+                if self.verbose:
+                    print("[NORMAL TRAFFIC MANAGER] queue {} and {} is passing.".format(line0, line1))
+                self._on_traffic_light_changed(line0, line1)
+
             line0, line1 = self.traffic_lights[self.cur_traffic_index]
-            end_time = time.time() + self.green_delay_time
-            print("[NORMAL TRAFFIC MANAGER] queue {} and {} is passing.".format(line0, line1))
-            self._on_traffic_light_changed(line0, line1)
-
-            while time.time() < end_time:
-                queues = self.traffic_queues.getCopy((line0, line1))
-                # 队列没有车辆时，循环检测
-                if len(queues[0]) == 0 and len(queues[1]) == 0:
-                    time.sleep(self.rate)
+            end_time = self.green_end_time
+            if self.clock.now() < end_time:
+                queues = self.traffic_queues.getQueueState((line0, line1))
+                # 队列没有车辆时，等待车辆到达或者绿灯时间结束
+                if queues[0].length == 0 and queues[1].length == 0:
+                    yield self.traffic_queues.waitForCars((line0, line1), timeout=end_time - self.clock.now())
                     continue
                 # 任意一条队列有车时，弹出队首车辆通行，时间为下一辆车进入到停止线位置，即
-                if len(queues[0]) > 0:
-                    self.traffic_queues.shrinkQueue(line0, 1)
-                    self.total_counter += 1
-                if len(queues[1]) > 0:
-                    self.traffic_queues.shrinkQueue(line1, 1)
-                    self.total_counter += 1
+                if queues[0].length > 0:
+                    self._release(line0, 1)
+                if queues[1].length > 0:
+                    self._release(line1, 1)
                 self._on_queue_changed()
-                time.sleep(min(max(end_time - time.time(), 0), self.append_time))  # 等待车辆通过或者绿灯时间到达
+                yield min(max(end_time - self.clock.now(), 0), self.append_time)  # 等待车辆通过或者绿灯时间到达
+                continue
 
             # 绿灯停止，黄灯亮起
+            self.green_end_time = None
             self._on_traffic_light_changed(None)
-            print("waiting time >> total_cars: {}".format(self.total_counter))
-            print(self.traffic_queues.getSizesStr())
-            print("--" * 10)
-            time.sleep(self.yellow_delay_time)
+            if self.verbose:
+                print("waiting time >> total_cars: {}, mean delay: {:.2f}s, max delay: {:.2f}s".format(
+                    self.total_counter, self.mean_delay(), self.max_delay))
+                print(self.traffic_queues.getSizesStr())
+                print("--" * 10)
+            yield self.yellow_delay_time
 
     # TODO::获取优先级最高的队列（两条），
-    def _getPriorityQueue(self, curQueueList: List[deque]):
+    def _getPriorityQueue(self, curQueueStates: List[QueueState]):
         queue_index, car_nums = -1, 0
-        for i in range(len(curQueueList)):
-            if len(curQueueList[i]) > car_nums:
+        for i in range(len(curQueueStates)):
+            if curQueueStates[i].length > car_nums:
                 queue_index = i
-                car_nums = len(curQueueList[i])
+                car_nums = curQueueStates[i].length
         if queue_index == -1:
             return -1, -1
-        return queue_index, random.randint(1, car_nums)
+        return queue_index, self.random.randint(1, car_nums)
 
     def _onShutdown(self):
         return
 
 
+class PressureTrafficManager(threading.Thread, TrafficManager):
+    """
+    加权 max-pressure 调度: 以相位(一组互不冲突, 可同时放行的队列)为单位打分,
+    队列的分数为 车辆数 + 权重之和 * weight_factor + 队首车辆等待时间 * age_factor,
+    选择分数最高的相位, 按饱和流率(每 append_time 通过一辆车)计算本次放行的车辆数,
+    单次绿灯不超过 max_green_time. 等待时间一项保证任何队列都不会一直得不到放行.
+    切换相位时只有当前相位还有车辆等待才需要黄灯; 同一相位连续放行时车流不中断, 只在开始时计入 pass_time
+    """
+
+    CHECKPOINT_FIELDS = TrafficManager.CHECKPOINT_FIELDS + ('cur_phase', 'next_phase', 'flowing')
+
+    def __init__(self, controller):
+        threading.Thread.__init__(self)
+        TrafficManager.__init__(self, controller)
+        self.phases = COMPATIBLE_PHASES
+        self.cur_phase = None
+        self.next_phase = None  # 黄灯之后放行的相位
+        self.flowing = False  # 当前相位上一次放行了车辆, 车流没有中断
+        self.pass_time = STRAIGHT_PASS_TIME
+        self.append_time = APPEND_TIME
+        self.yellow_delay_time = YELLOW_DELAY_TIME
+        self.max_green_time = GREEN_DELAY_TIME
+        self.weight_factor = 0.1  # 权重为 10 的车辆相当于多 1 辆车
+        self.age_factor = 1.0  # 队首车辆每等待 1s 相当于多 1 辆车
+
+    def run(self):
+        TrafficManager.run(self)
+
+    def process(self):
+        if self.verbose:
+            print("Pressure Traffic Manager Run.")
+        # 一次绿灯内最多通过的车辆数
+        max_cars = max(int((self.max_green_time - self.pass_time) / self.append_time), 1)
+        while True:
+            curQueueStates = self.traffic_queues.getQueueState()
+            if self.next_phase is not None:
+                phase, self.next_phase = self.next_phase, None
+            else:
+                phase = self._getPriorityPhase(curQueueStates, self.clock.now())
+
+            # 所有队列均为空, 保持当前绿灯等待车辆到达
+            if phase is None:
+                self.flowing = False
+                yield self.traffic_queues.waitForCars()
+                continue
+
+            if phase != self.cur_phase:
+                self.flowing = False
+                # 当前相位的队列都为空时没有车辆需要清空路口, 直接切换, 不需要黄灯
+                if self.cur_phase is not None and any(curQueueStates[i].length for i in self.cur_phase):
+                    # 黄灯结束后放行已经选定的相位
+                    self._on_traffic_light_changed(None)
+                    self.cur_phase, self.next_phase = None, phase
+                    yield self.yellow_delay_time
+                    continue
+                self.cur_phase = phase
+                self._on_traffic_light_changed(*phase)
+
+            # 同一相位的绿灯延续时车流没有中断, 不需要再次计入第一辆车的通过时间
+            pass_time = 0.0 if self.flowing else self.pass_time
+            released = 0
+            for i in phase:
+                released = max(released, self._release(i, min(curQueueStates[i].length, max_cars), pass_time))
+            if self.verbose:
+                print("[PRESSURE TRAFFIC MANAGER] queue {} pass {} cars".format(phase, released))
+            self._on_queue_changed()
+            self.flowing = released > 0
+            yield pass_time + released * self.append_time  # 等待车辆通过路口
+
+    def _getPressure(self, state: QueueState, now: float) -> float:
+        if state.length == 0:
+            return 0.0
+        return state.length + state.weight * self.weight_factor + (now - state.head_time) * self.age_factor
+
+    # 返回分数最高的相位, 所有队列为空时返回 None
+    def _getPriorityPhase(self, curQueueStates: List[QueueState], now: float):
+        pressures = [self._getPressure(state, now) for state in curQueueStates]
+        best_phase, best_score = None, 0.0
+        for phase in self.phases:
+            score = sum(pressures[i] for i in phase)
+            if score > best_score:
+                best_phase, best_score = phase, score
+        return best_phase
+
+    def _onShutdown(self):
+        return
+
+
+class ArrivalGenerator(object):
+    """
+    离散事件模拟中的车辆到达, 每个路口按泊松过程到达, rate 为单个路口每秒到达的车辆数,
+    也可以是 4 个路口各自的到达率
+    """
+
+    def __init__(self, controller, rate=0.5, seed=None):
+        self.controller = controller  # type: Controller
+        self.traffic_queues = self.controller.traffic_queues  # type: TrafficQueues
+        self.clock = self.controller.clock  # type: EventClock
+        self.rates = list(rate) if isinstance(rate, (list, tuple)) else [rate] * 4
+        self.random = random.Random(seed)
+        self.total_counter = 0
+        self.next_time = None  # 下一辆车的到达时间
+
+    def process(self):
+        total_rate = sum(self.rates)
+        while True:
+            if self.next_time is None:
+                self.next_time = self.clock.now() + self.random.expovariate(total_rate)
+            yield self.next_time - self.clock.now()
+            self.next_time = None
+            line_from = self.random.choices(range(4), weights=self.rates)[0]
+            line_to = (line_from + self.random.randint(1, 3)) % 4
+            car = CarInfo(self.total_counter, line_from, line_to, self.clock.now(), self.random.randint(0, 10))
+            self.traffic_queues.insertCar(car)
+            self.controller.on_traffic_queue_changed()
+            self.total_counter += 1
+
+    def get_state(self) -> dict:
+        return {"rates": self.rates,
+                "random": self.random.getstate(),
+                "total_counter": self.total_counter,
+                "next_time": self.next_time}
+
+    def set_state(self, state: dict):
+        self.rates = state["rates"]
+        self.random.setstate(state["random"])
+        self.total_counter = state["total_counter"]
+        self.next_time = state["next_time"]
+
+
+"""
+车辆到达记录与回放
+记录文件每行一个 json 对象, 字段与 /register_batch 相同, 另加到达时间 t:
+    {"t": 1598151845.12, "id": 3, "line_from": 0, "line_to": 2, "weight": 5}
+同一段记录可以在实时模式下按原速度回放, 也可以在离散事件模式下尽快回放,
+用来比较不同的调度算法
+"""
+
+
+class TraceWriter(object):
+    """追加写入, 带缓冲, 每隔 flush_interval 秒刷新一次到磁盘. 关闭之后的记录被丢弃"""
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open(path, 'a', buffering=1 << 16)
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        self.total_counter = 0
+
+    def record(self, car: CarInfo):
+        self.record_many([car])
+
+    def record_many(self, cars):
+        lines = "".join(json.dumps({"t": car.TimeStart,
+                                    "id": car.Id,
+                                    "line_from": car.LineFrom,
+                                    "line_to": car.LineTo,
+                                    "weight": car.Weight}) + "\n" for car in cars)
+        # 在 web 线程中车辆插入成功之后调用, 写入失败时不能影响请求的结果
+        with self.lock:
+            if self.file.closed:
+                return
+            try:
+                self.file.write(lines)
+                self.total_counter += len(cars)
+                now = time.time()
+                if now - self.last_flush >= self.flush_interval:
+                    self.file.flush()
+                    self.last_flush = now
+            except OSError as e:
+                print("trace write error: ", e)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_trace(path):
+    """依次返回记录中的 (到达时间, CarInfo), 跳过无法解析的行"""
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield float(record['t']), CarInfo.from_record(record, float(record['t']))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+
+class TraceReplayer(object):
+    """
+    按记录中的时间间隔把车辆插入 TrafficQueues, 是一个时钟进程:
+    WallClock 下按原速度回放, EventClock 下直接跳到下一辆车的到达时间
+    """
+
+    def __init__(self, controller, path):
+        self.controller = controller
+        self.traffic_queues = self.controller.traffic_queues
+        self.clock = self.controller.clock
+        self.path = path
+        self.total_counter = 0
+
+    def process(self):
+        last = None
+        for t, car in read_trace(self.path):
+            if last is not None and t > last:
+                yield t - last
+            last = t
+            car.TimeStart = self.clock.now()
+            self.traffic_queues.insertCar(car)
+            self.controller.on_traffic_queue_changed()
+            self.total_counter += 1
+
+    def run(self):
+        self.clock.process(self.process())
+
+
+# 可选的调度策略
+TRAFFIC_MANAGERS = {"normal": NormalTrafficManager,
+                    "smart": SmartTrafficManager,
+                    "smart_phase": SmartPhaseTrafficManager,
+                    "pressure": PressureTrafficManager}
+
+CHECKPOINT_VERSION = 1  # 检查点文件格式的版本
+
+
 class WebServer(threading.Thread):
-    def __init__(self, traffic_queues):
+    def __init__(self, traffic_queues, metrics=None):
         super().__init__()
         self.traffic_queues = traffic_queues  # type: TrafficQueues
+        self.metrics = metrics  # type: TrafficMetrics
+        self.trace = None  # type: TraceWriter  # 不为空时记录每辆成功注册的车辆
+        self.stream = StateStream()  # /stream 推送的队列长度与相位
         self.host = '127.0.0.1'
         self.port = 8989
         self.app = Flask(__name__)
@@ -297,19 +737,94 @@ class WebServer(threading.Thread):
 
     def _add_api_tasks(self):
         self.app.add_url_rule('/register', 'register_task', self._api_register, methods=['POST'])
+        self.app.add_url_rule('/register_batch', 'register_batch_task', self._api_register_batch, methods=['POST'])
+        self.app.add_url_rule('/metrics', 'metrics_task', self._api_metrics, methods=['GET'])
+        self.app.add_url_rule('/stream', 'stream_task', self._api_stream, methods=['GET'])
 
     def _api_register(self):
-        car = CarInfo()
-        car.Id = request.form.get('id')
-        car.LineFrom = request.form.get('line_from')
-        car.LineTo = request.form.get('line_to')
-        car.TimeStart = time.time()
-        car.Weight = request.form.get('weight')
+        try:
+            car = CarInfo.from_record(request.form, time.time())
+        except ValueError:
+            return "fail"
         # print(request.remote_addr)
         if self.traffic_queues.insertCar(car):
+            if self.trace is not None:
+                self.trace.record(car)
+            self.publish_queues()
             return "success"
         return "fail"
 
+    # 批量注册, 请求体为 json 数组或者每行一个 json 对象, 字段与 /register 相同
+    # 返回与请求顺序一致的 ["success", "fail", ...]
+    def _api_register_batch(self):
+        records = self._parse_batch(request.get_data(as_text=True))
+        now = time.time()
+        cars, valid = [], []
+        for record in records:
+            if not isinstance(record, dict):
+                valid.append(False)
+                continue
+            try:
+                car = CarInfo.from_record(record, now)
+            except ValueError:
+                valid.append(False)
+                continue
+            cars.append(car)
+            valid.append(True)
+        res = self.traffic_queues.insertCars(cars)
+        if self.trace is not None:
+            self.trace.record_many([car for car, ok in zip(cars, res) if ok])
+        self.publish_queues()
+        inserted = iter(res)
+        return jsonify(["success" if ok and next(inserted) else "fail" for ok in valid])
+
+    # 各等待队列长度, 到达/离开速率, 等待时间分位数及当前放行的队列
+    def _api_metrics(self):
+        if self.metrics is None:
+            return jsonify({})
+        return jsonify(self.metrics.snapshot(self.traffic_queues.getWaittingQueueSize8()))
+
+    # 队列长度与相位变化的推送流, 默认为 Server-Sent Events, ?format=ndjson 时每行一个 json 对象
+    # 第一条消息为完整状态, 之后只包含变化的队列长度({"队列编号": 长度})和相位
+    def _api_stream(self):
+        ndjson = request.args.get('format') == 'ndjson'
+
+        def generate():
+            for event in self.stream.subscribe(queue_sizes=self.traffic_queues.getWaittingQueueSize8):
+                if event is None:
+                    yield "\n" if ndjson else ": keep-alive\n\n"
+                elif ndjson:
+                    yield json.dumps(event) + "\n"
+                else:
+                    yield "event: {}\ndata: {}\n\n".format(event["type"], json.dumps(event))
+
+        mimetype = 'application/x-ndjson' if ndjson else 'text/event-stream'
+        return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache'})
+
+    # 有订阅者时才读取并发布队列长度
+    def publish_queues(self):
+        if self.stream.subscribers:
+            self.stream.publish_queues(self.traffic_queues.getWaittingQueueSize8())
+
+    @staticmethod
+    def _parse_batch(body: str) -> list:
+        body = body.strip()
+        if body.startswith('['):
+            try:
+                records = json.loads(body)
+            except ValueError:
+                return []
+            return records if isinstance(records, list) else []
+        records = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+
     def run(self):
         self.app.run(host=self.host, port=self.port, debug=False, use_reloader=False)
 
@@ -323,239 +838,250 @@ class WebServer(threading.Thread):
         self._on_shutdown()
 
 
-import pygame
-from pygame.locals import *
-
-pygame.init()
-
-SCREEN_SIZE = (800, 800)
-WIDTH, HEIGHT = SCREEN_SIZE
-SCREEN = pygame.display.set_mode(SCREEN_SIZE, 0, 32)
-
-INTERSECTION_IMAGE = "asset/image/intersection1.jpg"
-BACKGROUND_IMAGE = pygame.image.load(INTERSECTION_IMAGE).convert()
-BACKGROUND_IMAGE = pygame.transform.scale(BACKGROUND_IMAGE, SCREEN_SIZE)
-
-CAR_IMAGE_SIZE = (50, 25)
-image_names = ["asset/image/car0.png",
-               "asset/image/car2.png"]
-CAR_IMAGE_LIST = []
-for name in image_names:
-    image = pygame.image.load(name).convert_alpha()
-    image = pygame.transform.scale(image, CAR_IMAGE_SIZE)
-    CAR_IMAGE_LIST.append(image)
-
-WAIT_LINE_INIT = [[WIDTH / 2 + WIDTH / 20, HEIGHT / 2 + HEIGHT / 10],  # 0
-                  [WIDTH / 2 + WIDTH / 50, HEIGHT / 2 + HEIGHT / 10],  # 1
-                  [WIDTH / 2 + 105, HEIGHT / 2 - 48],  # 2
-                  [WIDTH / 2 + 105, HEIGHT / 2 - 25],  # 3
-                  [WIDTH / 2 - 40, HEIGHT / 2 - 128],  # 4
-                  [WIDTH / 2 - 13, HEIGHT / 2 - 128],  # 5
-                  [WIDTH / 2 - 105, HEIGHT / 2 + 30],  # 6
-                  [WIDTH / 2 - 105, HEIGHT / 2 + 8]]  # 7
-
-
-class PygameCar(pygame.sprite.Sprite):
-    def __init__(self, road_id):
-        super().__init__()
-        self.road_id = road_id
-        self.image = random.choice(CAR_IMAGE_LIST)
-        self.car_id = 0
-        self.rect = None  # type: pygame.Rect
-        self.increment = [0, 0]
-        self.inter = 5
-        self._rotate_image()
-
-    def _rotate_image(self):
-        road_directioin = int(self.road_id / 2)
-        self.image = pygame.transform.rotate(self.image, (road_directioin + 1) * 90)
-        self.rect = self.image.get_rect()
-        if road_directioin == 0:
-            self.increment = [0, self.rect.height + self.inter]
-        elif road_directioin == 1:
-            self.increment = [self.rect.width + self.inter, 0]
-        elif road_directioin == 2:
-            self.increment = [0, -(self.rect.height + self.inter)]
-        elif road_directioin == 3:
-            self.increment = [-(self.rect.width + self.inter), 0]
-
-    def update(self, pos):
-        self.rect.midtop = (WAIT_LINE_INIT[self.road_id][0] + self.increment[0] * pos,
-                            WAIT_LINE_INIT[self.road_id][1] + self.increment[1] * pos)
-
-
-lock = threading.Lock()
-
-
-class MyGroup(pygame.sprite.Group):
-    def __init__(self):
-        super().__init__()
-
-    def draw(self, surface):
-        lock.acquire()
-        super().draw(surface)
-        lock.release()
-
-
 class Scheduler(object):
-    def __init__(self, active_ui=True):
+    def __init__(self, active_ui=True, clock=None, policy="normal"):
         super().__init__()
         self.active_ui = active_ui
-        self.screen = SCREEN
-        self.all_sprite_group = MyGroup()
-        self.clock = pygame.time.Clock()
-        self.road_queue = [[] for i in range(8)]
-        self.controller = Controller(self)
-        self.road_id_texts = dict()
-        self._init()
-
-    def _init(self):
-        fontObj = pygame.font.Font(None, 30)
-        for id, pos in enumerate(WAIT_LINE_INIT):
-            textSurfaceObj = fontObj.render(str(id), True, RED)  # type: pygame.Surface
-            rect = textSurfaceObj.get_rect()  # type: pygame.Rect
-            if id == 0 or id == 1:
-                rect.midbottom = pos
-            elif id == 2 or id == 3:
-                rect.midleft = (pos[0]-40, pos[1]+15)
-            elif id == 4 or id == 5:
-                rect.center = (pos[0], pos[1]+65)
-            else:
-                rect.midleft = (pos[0]+35, pos[1]+10)
-            self.road_id_texts[id] = [textSurfaceObj, rect]
-
-    def _draw_road_id(self, screen):
-        for id, obj in self.road_id_texts.items():
-            screen.blit(obj[0], obj[1])
+        self.ui = None
+        if self.active_ui:
+            # 仅在需要界面时才加载 pygame, 无界面模式下不 import pygame
+            from scheduler_ui import SchedulerUI
+            self.ui = SchedulerUI()
+        self.controller = Controller(self.ui, clock=clock, policy=policy)
 
     def run(self):
         self.controller.run()
-        self.clock.tick(30)
-        running = True
-        while True:
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    running = False
-            if not running:
-                break
-            self.screen.blit(BACKGROUND_IMAGE, (0, 0))
-            self._draw_road_id(self.screen)
-
-            # self.all_sprite_group.update()
-            self.all_sprite_group.draw(self.screen)
-            pygame.display.update()
-        pygame.quit()
-
-    def update_traffic_queue(self, queue_size_list):
-        delete_list = []
-        add_list = []
-        for road_id, length in enumerate(queue_size_list):
-            dec = len(self.road_queue[road_id]) - length
-            if dec == 0:
-                continue
-            # 更新等待队列长度
-            if dec > 0:
-                for k in range(dec):
-                    car = self.road_queue[road_id][0]
-                    delete_list.append(car)
-                    self.road_queue[road_id].remove(car)
-
-            if dec < 0:
-                for k in range(-dec):
-                    new_car = PygameCar(road_id)
-                    self.road_queue[road_id].append(new_car)
-                    add_list.append(new_car)
-
-        lock.acquire()
-        for car in delete_list:
-            car.kill()
-        for car in add_list:
-            self.all_sprite_group.add(car)
-        for road_id, length in enumerate(queue_size_list):
-            for pos in range(length):
-                self.road_queue[road_id][pos].update(pos)
-        lock.release()
-
-    def update_traffic_light(self, *args):
-        fontObj = pygame.font.Font(None, 30)
-        if len(args) == 0 or args[0] is None:
-            for id, obj in self.road_id_texts.items():
-                # obj[0].set_colorkey(YELLOW)
-                obj[0] = fontObj.render(str(id), True, YELLOW)
+        if self.ui is not None:
+            self.ui.run()
         else:
-            for id, obj in self.road_id_texts.items():
-                # obj[0].set_colorkey(RED)
-                obj[0] = fontObj.render(str(id), True, RED)
-            for id in args:
-                print("set green: {}".format(id))
-                self.road_id_texts[id][0] = fontObj.render(str(id), True, GREEN)
+            # 无界面模式下阻塞直到管理线程与 web 线程结束
+            self.controller.wait()
 
-    def _on_shutdown(self):
-        return
-
-    def test_initial_car_postion(self):
-        self.clock.tick(30)
-        running = True
-        for i in range(8):
-            car = PygameCar(road_id=i)
-            car.rect.midtop = WAIT_LINE_INIT[i]
-            self.all_sprite_group.add(car)
-        # car = PygameCar(5)
-        # car.rect.midtop = WAIT_LINE_INIT[5]
-        # self.all_sprite_group.add(car)
-
-        while True:
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    running = False
-            if not running:
-                break
-            self.screen.blit(BACKGROUND_IMAGE, (0, 0))
-
-            # self.all_sprite_group.update()
-            self.all_sprite_group.draw(self.screen)
-            pygame.display.update()
-        pygame.quit()
+    def _on_shutdown(self, wait=True):
+        self.controller._on_shutdown(wait=wait)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._on_shutdown()
+        self._on_shutdown(wait=exc_type is None)
 
 
 class Controller():
-    def __init__(self, ui):
+    def __init__(self, ui, clock=None, policy="normal", web=True):
         super().__init__()
-        self.ui = ui  # type: Scheduler
-        self.traffic_queues = TrafficQueues()
-        self.traffic_manager = NormalTrafficManager(self)
-        self.web_server = WebServer(self.traffic_queues)
+        self.ui = ui  # type: SchedulerUI
+        self.clock = clock if clock is not None else WallClock()
+        self.metrics = TrafficMetrics(self.clock)
+        self.traffic_queues = TrafficQueues(metrics=self.metrics)
+        self.policy = policy
+        self.traffic_manager = TRAFFIC_MANAGERS[policy](self)
+        # 路网模拟中的路口不需要 web 接口
+        self.web_server = WebServer(self.traffic_queues, metrics=self.metrics) if web else None
+        self.replayer = None  # type: TraceReplayer
+        self.arrivals = None  # type: ArrivalGenerator  # 离散事件模拟的车辆来源, 开始模拟或者恢复检查点时创建
+        self.sim_start = self.clock.now()  # 模拟开始的时间, 恢复检查点后仍为最初开始的时间
+        self.event_log = None  # type: EventLogWriter
+        self.on_departure = None  # 车辆通过路口后的回调, 路网模拟中用来把车辆送往下游路口
+
+    # 记录每辆通过 web 接口注册的车辆
+    def record(self, path):
+        self.web_server.trace = TraceWriter(path)
+
+    # 用记录文件代替随机到达/web 接口作为车辆来源
+    def replay(self, path):
+        self.replayer = TraceReplayer(self, path)
+
+    # 把到达, 相位变化与离开写入二进制事件日志
+    def log_events(self, path):
+        self.event_log = EventLogWriter(path)
+        self.traffic_queues.event_log = self.event_log
 
     def run(self):
         self.traffic_manager.start()
-        self.web_server.start()
+        if self.web_server is not None:
+            self.web_server.start()
+        if self.replayer is not None:
+            threading.Thread(target=self.replayer.run, daemon=True).start()
+
+    # 离散事件模拟, 不启动任何线程, 在数秒内完成 duration 秒的路口交通, 返回统计结果
+    # 可以多次调用继续模拟, 从检查点恢复后继续使用检查点中的车辆到达; 统计结果从模拟开始累计
+    def simulate(self, duration, arrival_rate=0.5, seed=None, verbose=True) -> dict:
+        if not isinstance(self.clock, EventClock):
+            raise RuntimeError("simulate() needs an EventClock")
+        manager = self.traffic_manager
+        manager.verbose = False
+        if self.arrivals is None:
+            manager.random.seed(seed)
+            if self.replayer is not None:
+                self.arrivals = self.replayer
+            else:
+                self.arrivals = ArrivalGenerator(self, rate=arrival_rate, seed=seed)
+            self.clock.process(manager.timed_process())
+            self.clock.process(self.arrivals.process())
+        arrivals = self.arrivals
+        start = time.time()
+        self.clock.run(until=self.clock.now() + duration)
+        elapsed = self.clock.now() - self.sim_start
+        wait_time = self.metrics.wait_time()
+        res = {"duration": elapsed,
+               "cost": time.time() - start,
+               "events": self.clock.event_counter,
+               "arrivals": arrivals.total_counter,
+               "departures": manager.total_counter,
+               "throughput": manager.total_counter / elapsed if elapsed else 0.0,
+               "mean_delay": manager.mean_delay(),
+               "p95_delay": wait_time.percentile(95),
+               "max_delay": manager.max_delay,
+               "max_queue": self.metrics.max_length(),
+               "decisions": manager.decisions,
+               "cpu_per_decision": manager.decision_time / manager.decisions if manager.decisions else 0.0}
+        if verbose:
+            print("simulated {duration}s in {cost:.2f}s: arrivals: {arrivals}, departures: {departures}, "
+                  "events: {events}".format(**res))
+            print("mean delay: {mean_delay:.2f}s, p95 delay: {p95_delay:.2f}s, max delay: {max_delay:.2f}s, "
+                  "max queue: {max_queue}".format(**res))
+            print(self.traffic_queues.getSizesStr())
+        return res
 
+    # 保存离散事件模拟的完整状态: 时钟, 等待队列, 统计指标, 交通管理器与车辆到达的状态(包括随机数状态)
+    def checkpoint(self, path):
+        if not isinstance(self.clock, EventClock) or not isinstance(self.arrivals, ArrivalGenerator):
+            raise RuntimeError("checkpoint() needs a running simulate() with random arrivals")
+        state = {"version": CHECKPOINT_VERSION,
+                 "now": self.clock.now(),
+                 "events": self.clock.event_counter,
+                 "idle_timeouts": self.clock.idle_timeouts(),
+                 "sim_start": self.sim_start,
+                 "policy": self.policy,
+                 "queues": self.traffic_queues.getState(),
+                 "metrics": self.metrics.get_state(),
+                 "manager": self.traffic_manager.get_state(),
+                 "arrivals": self.arrivals.get_state()}
+        with open(path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # 从检查点恢复, 之后调用 simulate() 继续模拟. policy 与检查点不同时, 新的交通管理器从头开始运行,
+    # 只继承累计的通过车辆数与等待时间, 队列, 统计指标与车辆到达仍然从检查点继续,
+    # 用于以同一段预热后的交通比较不同的调度策略
+    @classmethod
+    def restore(cls, path, policy=None, web=False):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError("unsupported checkpoint: {}".format(path))
+        policy = policy or state["policy"]
+        controller = cls(None, clock=EventClock(start=state["now"]), policy=policy, web=web)
+        controller.clock.event_counter = state["events"]
+        controller.clock.schedule_idle(state.get("idle_timeouts", []))
+        controller.sim_start = state["sim_start"]
+        controller.traffic_queues.setState(state["queues"])
+        controller.metrics.set_state(state["metrics"])
+        manager = controller.traffic_manager
+        manager.verbose = False
+        if policy == state["policy"]:
+            manager.set_state(state["manager"])
+        else:
+            for name in ('total_counter', 'total_delay', 'max_delay'):
+                setattr(manager, name, state["manager"][name])
+        controller.arrivals = ArrivalGenerator(controller)
+        controller.arrivals.set_state(state["arrivals"])
+        if policy != state["policy"]:
+            controller.clock.process(manager.timed_process())
+        elif manager.resume_at is None:
+            controller.clock.process_now(manager.timed_process(resumed=True))
+        else:
+            controller.clock.process_at(max(manager.resume_at, state["now"]), manager.timed_process())
+        controller.clock.process_now(controller.arrivals.process())
+        return controller
+
+    def on_cars_departed(self, cars):
+        if self.on_departure is not None:
+            self.on_departure(cars)
+
+    # 以下两个回调在管理线程中执行, 只把状态发布到界面的事件队列和 /stream 推送流, 由渲染循环/订阅线程取出, 不会拖慢调度
     def on_traffic_queue_changed(self):
-        self.ui.update_traffic_queue(self.traffic_queues.getWaittingQueueSize8())
+        if self.web_server is not None:
+            self.web_server.publish_queues()
+        if self.ui is None:
+            return
+        self.ui.events.publish_queue(self.traffic_queues.getWaittingQueueSize8())
 
     def on_traffic_light_changed(self, *args):
-        self.ui.update_traffic_light(*args)
+        self.metrics.set_phase(*args)
+        if self.event_log is not None:
+            self.event_log.phase(self.clock.now(), *args)
+        if self.web_server is not None:
+            self.web_server.stream.publish_phase(*args)
+        if self.ui is None:
+            return
+        self.ui.events.publish_light(*args)
 
-    def _on_shutdown(self):
-        if self.traffic_manager:
+    # 等待管理线程与 web 线程结束, 离散事件模式下线程不会启动
+    def wait(self):
+        if self.traffic_manager and self.traffic_manager.is_alive():
             self.traffic_manager.join()
-        if self.web_server:
+        if self.web_server and self.web_server.is_alive():
             self.web_server.join()
 
+    # 线程结束之后才关闭记录文件; wait 为 False 时(例如 Ctrl-C 中断)不等待, 直接关闭, 之后的记录被丢弃
+    def _on_shutdown(self, wait=True):
+        if wait:
+            self.wait()
+        if self.web_server and self.web_server.trace is not None:
+            self.web_server.trace.close()
+        if self.event_log is not None:
+            self.event_log.close()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._on_shutdown()
+        self._on_shutdown(wait=exc_type is None)
 
 
 if __name__ == '__main__':
-    with Scheduler(active_ui=True) as app:
-        app.run()
-        # app.test_initial_car_postion()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headless', action='store_true', help="run the scheduler without pygame UI")
+    parser.add_argument('--simulate', type=float, default=None,
+                        help="discrete-event mode: simulate the given seconds of traffic without UI")
+    parser.add_argument('--rate', type=float, default=0.5, help="arrivals per second per approach")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--policy', default=None, choices=sorted(TRAFFIC_MANAGERS.keys()),
+                        help="default: normal, or the policy stored in --restore")
+    parser.add_argument('--record', default=None, help="append every registered car to this trace file")
+    parser.add_argument('--replay', default=None,
+                        help="feed cars from a trace file, at original speed or as fast as possible with --simulate")
+    parser.add_argument('--event-log', default=None,
+                        help="append arrivals, phase changes and departures to this binary event log")
+    parser.add_argument('--checkpoint', default=None, help="with --simulate: save the final simulation state here")
+    parser.add_argument('--restore', default=None,
+                        help="with --simulate: continue from a checkpoint (--policy may differ from the checkpoint)")
+    args = parser.parse_args()
+    if args.restore and args.replay:
+        # 检查点中保存了随机到达的状态, 恢复后继续使用, 不能再用记录文件作为车辆来源
+        parser.error("--replay cannot be combined with --restore")
+
+    if args.simulate is not None:
+        if args.restore:
+            controller = Controller.restore(args.restore, policy=args.policy, web=True)
+        else:
+            controller = Controller(None, clock=EventClock(), policy=args.policy or "normal")
+        with controller:
+            if args.replay:
+                controller.replay(args.replay)
+            if args.event_log:
+                controller.log_events(args.event_log)
+            controller.simulate(args.simulate, arrival_rate=args.rate, seed=args.seed)
+            if args.checkpoint:
+                controller.checkpoint(args.checkpoint)
+    else:
+        with Scheduler(active_ui=not args.headless, policy=args.policy or "normal") as app:
+            if args.record:
+                app.controller.record(args.record)
+            if args.replay:
+                app.controller.replay(args.replay)
+            if args.event_log:
+                app.controller.log_events(args.event_log)
+            app.run()
+            # app.ui.test_initial_car_postion()
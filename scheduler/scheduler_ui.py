@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+pygame 界面, 仅在 Scheduler(active_ui=True) 时由 scheduler_server 加载,
+无界面模式下不会 import pygame 也不会初始化显示
+
+渲染限制在 FPS 帧/s, 背景只绘制一次, 之后每帧只重绘位置或图像改变了的精灵(车辆, 路口编号,
+帧率信息)所在的矩形区域, 界面与调度器同时运行时不会占满一个 cpu 核心
+"""
+
+import threading
+import random
+import time
+from collections import deque
+
+import pygame
+from pygame.locals import *
+
+from ui_events import UIEventQueue
+
+pygame.init()
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+BLUE = (0, 0, 255)
+YELLOW = (255, 255, 0)
+
+SCREEN_SIZE = (800, 800)
+WIDTH, HEIGHT = SCREEN_SIZE
+SCREEN = pygame.display.set_mode(SCREEN_SIZE, 0, 32)
+FPS = 30
+
+INTERSECTION_IMAGE = "asset/image/intersection1.jpg"
+BACKGROUND_IMAGE = pygame.image.load(INTERSECTION_IMAGE).convert()
+BACKGROUND_IMAGE = pygame.transform.scale(BACKGROUND_IMAGE, SCREEN_SIZE)
+
+CAR_IMAGE_SIZE = (50, 25)
+image_names = ["asset/image/car0.png",
+               "asset/image/car2.png"]
+CAR_IMAGE_LIST = []
+for name in image_names:
+    image = pygame.image.load(name).convert_alpha()
+    image = pygame.transform.scale(image, CAR_IMAGE_SIZE)
+    CAR_IMAGE_LIST.append(image)
+
+# 启动时预先旋转好每个行驶方向(road_id // 2)的车辆图像, 生成车辆时不再调用 transform
+ROTATED_CAR_IMAGES = [[pygame.transform.rotate(image, (direction + 1) * 90) for image in CAR_IMAGE_LIST]
+                      for direction in range(4)]
+
+# 路口编号的颜色: 红灯, 绿灯, 黄灯
+LABEL_COLORS = (RED, GREEN, YELLOW)
+
+WAIT_LINE_INIT = [[WIDTH / 2 + WIDTH / 20, HEIGHT / 2 + HEIGHT / 10],  # 0
+                  [WIDTH / 2 + WIDTH / 50, HEIGHT / 2 + HEIGHT / 10],  # 1
+                  [WIDTH / 2 + 105, HEIGHT / 2 - 48],  # 2
+                  [WIDTH / 2 + 105, HEIGHT / 2 - 25],  # 3
+                  [WIDTH / 2 - 40, HEIGHT / 2 - 128],  # 4
+                  [WIDTH / 2 - 13, HEIGHT / 2 - 128],  # 5
+                  [WIDTH / 2 - 105, HEIGHT / 2 + 30],  # 6
+                  [WIDTH / 2 - 105, HEIGHT / 2 + 8]]  # 7
+
+
+class PygameCar(pygame.sprite.DirtySprite):
+    def __init__(self, road_id):
+        super().__init__()
+        self.road_id = road_id
+        self.pos = -1
+        self.image = None  # type: pygame.Surface
+        self.car_id = 0
+        self.rect = None  # type: pygame.Rect
+        self.increment = [0, 0]
+        self.inter = 5
+        self._rotate_image()
+
+    def _rotate_image(self):
+        road_directioin = int(self.road_id / 2)
+        self.image = random.choice(ROTATED_CAR_IMAGES[road_directioin])
+        self.rect = self.image.get_rect()
+        if road_directioin == 0:
+            self.increment = [0, self.rect.height + self.inter]
+        elif road_directioin == 1:
+            self.increment = [self.rect.width + self.inter, 0]
+        elif road_directioin == 2:
+            self.increment = [0, -(self.rect.height + self.inter)]
+        elif road_directioin == 3:
+            self.increment = [-(self.rect.width + self.inter), 0]
+
+    def update(self, pos):
+        if pos == self.pos:
+            return
+        self.pos = pos
+        self.dirty = 1
+        self.rect.midtop = (WAIT_LINE_INIT[self.road_id][0] + self.increment[0] * pos,
+                            WAIT_LINE_INIT[self.road_id][1] + self.increment[1] * pos)
+
+
+class LabelSprite(pygame.sprite.DirtySprite):
+    """路口编号, 颜色表示红绿灯状态"""
+
+    def __init__(self, image, rect):
+        super().__init__()
+        self.image = image  # type: pygame.Surface
+        self.rect = rect  # type: pygame.Rect
+
+    def set_image(self, image):
+        if image is self.image:
+            return
+        self.image = image
+        self.dirty = 1
+
+
+class StatsSprite(pygame.sprite.DirtySprite):
+    """左上角的帧率与 cpu 占用, 每秒刷新一次"""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock  # type: pygame.time.Clock
+        self.font = pygame.font.Font(None, 24)
+        self.image = self.font.render("", True, WHITE, BLACK)
+        self.rect = self.image.get_rect(topleft=(5, 5))
+        self.last_time = time.time()
+        self.last_cpu = time.process_time()
+
+    def update(self):
+        now = time.time()
+        if now - self.last_time < 1:
+            return
+        cpu = time.process_time()
+        # cpu 为整个进程(包括交通管理与 web 线程)的占用, render 为上一帧绘制所用的时间
+        text = "fps: {:.1f}  render: {}ms  cpu: {:.0f}%".format(
+            self.clock.get_fps(), self.clock.get_rawtime(), (cpu - self.last_cpu) / (now - self.last_time) * 100)
+        self.last_time, self.last_cpu = now, cpu
+        self.image = self.font.render(text, True, WHITE, BLACK)
+        self.rect = self.image.get_rect(topleft=(5, 5))
+        self.dirty = 1
+
+
+lock = threading.Lock()
+
+CAR_LAYER = 1
+STATS_LAYER = 2
+
+
+class MyGroup(pygame.sprite.LayeredDirty):
+    def __init__(self):
+        super().__init__()
+
+    # 返回需要刷新到屏幕上的矩形
+    def draw(self, surface, bgd=None):
+        lock.acquire()
+        rects = super().draw(surface, bgd)
+        lock.release()
+        return rects
+
+
+class SchedulerUI(object):
+    def __init__(self):
+        super().__init__()
+        self.screen = SCREEN
+        self.all_sprite_group = MyGroup()
+        self.clock = pygame.time.Clock()
+        self.events = UIEventQueue()  # Controller 发布的状态变化, 每帧取出一次
+        self.road_queue = [deque() for i in range(8)]  # 每条队列中的车辆, 第 k 辆停在第 k 个车位
+        self.hidden_cars = [deque() for i in range(8)]  # 队列变短后隐藏的车辆, 栈顶是离队尾最近的车位
+        self.road_id_texts = dict()  # type: dict[int, LabelSprite]
+        self.label_images = dict()  # (id, color) -> 预先渲染的路口编号
+        self.stats = StatsSprite(self.clock)
+        self.all_sprite_group.add(self.stats, layer=STATS_LAYER)
+        self.all_sprite_group.clear(self.screen, BACKGROUND_IMAGE)
+        self._init()
+
+    def _init(self):
+        fontObj = pygame.font.Font(None, 30)
+        for id, pos in enumerate(WAIT_LINE_INIT):
+            for color in LABEL_COLORS:
+                self.label_images[(id, color)] = fontObj.render(str(id), True, color)
+            textSurfaceObj = self.label_images[(id, RED)]  # type: pygame.Surface
+            rect = textSurfaceObj.get_rect()  # type: pygame.Rect
+            if id == 0 or id == 1:
+                rect.midbottom = pos
+            elif id == 2 or id == 3:
+                rect.midleft = (pos[0]-40, pos[1]+15)
+            elif id == 4 or id == 5:
+                rect.center = (pos[0], pos[1]+65)
+            else:
+                rect.midleft = (pos[0]+35, pos[1]+10)
+            label = LabelSprite(textSurfaceObj, rect)
+            self.road_id_texts[id] = label
+            self.all_sprite_group.add(label)
+
+    def run(self):
+        # 背景与所有精灵完整绘制一次, 之后每帧只刷新改变的区域
+        self.screen.blit(BACKGROUND_IMAGE, (0, 0))
+        self.all_sprite_group.repaint_rect(self.screen.get_rect())
+        self.all_sprite_group.draw(self.screen)
+        pygame.display.flip()
+        running = True
+        while running:
+            self.clock.tick(FPS)
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    running = False
+            queue_sizes, light = self.events.drain()
+            if light is not None:
+                self.update_traffic_light(*light)
+            if queue_sizes is not None:
+                self.update_traffic_queue(queue_sizes)
+            self.stats.update()
+            rects = self.all_sprite_group.draw(self.screen)
+            if rects:
+                pygame.display.update(rects)
+        pygame.quit()
+
+    # 车辆精灵之间没有区别, 队首车辆离开时不必把后面的车都向前挪一个车位,
+    # 等价于隐藏队尾的车辆; 队列变长时在队尾重新显示隐藏的车辆, 不够时再创建新车.
+    # 精灵一直留在 all_sprite_group 中(从 LayeredDirty 中移除精灵是 O(n) 的),
+    # 每次更新的开销只与队列长度的变化量有关
+    def update_traffic_queue(self, queue_size_list):
+        add_list = []
+        lock.acquire()
+        for road_id, length in enumerate(queue_size_list):
+            road_queue = self.road_queue[road_id]
+            hidden_cars = self.hidden_cars[road_id]
+            dec = len(road_queue) - length
+            # 更新等待队列长度
+            for k in range(dec):
+                car = road_queue.pop()
+                car.visible = 0
+                hidden_cars.append(car)
+            for k in range(-dec):
+                if hidden_cars:
+                    car = hidden_cars.pop()
+                    car.visible = 1
+                else:
+                    car = PygameCar(road_id)
+                    add_list.append(car)
+                car.update(len(road_queue))
+                road_queue.append(car)
+        for car in add_list:
+            self.all_sprite_group.add(car, layer=CAR_LAYER)
+        lock.release()
+
+    def update_traffic_light(self, *args):
+        if len(args) == 0 or args[0] is None:
+            colors = {id: YELLOW for id in self.road_id_texts}
+        else:
+            colors = {id: RED for id in self.road_id_texts}
+            for id in args:
+                print("set green: {}".format(id))
+                colors[id] = GREEN
+        lock.acquire()
+        for id, label in self.road_id_texts.items():
+            label.set_image(self.label_images[(id, colors[id])])
+        lock.release()
+
+    def _on_shutdown(self):
+        return
+
+    def test_initial_car_postion(self):
+        for i in range(8):
+            car = PygameCar(road_id=i)
+            car.update(0)
+            self.all_sprite_group.add(car, layer=CAR_LAYER)
+        # car = PygameCar(5)
+        # car.rect.midtop = WAIT_LINE_INIT[5]
+        # self.all_sprite_group.add(car)
+        self.run()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._on_shutdown()
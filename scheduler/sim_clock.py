@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+import heapq
+import threading
+import time
+
+"""
+时钟抽象, 交通管理器通过时钟推进时间
+WallClock:  真实时间, 用于界面演示, 每一步都真实地 sleep
+EventClock: 离散事件时钟, 以优先队列保存定时事件(车辆到达/红绿灯切换/车辆离开),
+            直接跳到下一个事件的时间点, 可以在数秒内模拟一整天的路口交通
+
+交通管理器的主循环写成生成器(process), 每次 yield 一个需要等待的时长(s)
+或者一个 Wait 对象(等待某个条件成立, 例如队列中有车), 由时钟决定如何等待
+"""
+
+
+class Signal(object):
+    """
+    条件通知, 交通管理器在队列为空时等待, 有车辆插入时被唤醒
+    实时模式下阻塞线程, 离散事件模式下挂起进程
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.waiters = 0  # 等待中的线程数, 没有线程等待时 notify 不需要加锁
+        self.parked = []  # 离散事件模式下挂起的进程
+
+    def notify(self):
+        if self.waiters:
+            with self.cond:
+                self.cond.notify_all()
+        if self.parked:
+            # 只唤醒条件已经成立的进程, 其他的继续挂起; 已经超时的进程移除
+            parked, self.parked = self.parked, []
+            for waiter in parked:
+                if waiter.done:
+                    continue
+                if waiter.predicate():
+                    waiter.wake()
+                else:
+                    self.parked.append(waiter)
+
+    def wait(self, predicate, timeout=None) -> bool:
+        with self.cond:
+            self.waiters += 1
+            try:
+                return self.cond.wait_for(predicate, timeout)
+            finally:
+                self.waiters -= 1
+
+
+class Wait(object):
+    """进程 yield Wait 对象时, 等待 signal 通知直到 predicate() 成立, 最多等待 timeout 秒"""
+
+    def __init__(self, signal: Signal, predicate, timeout=None):
+        self.signal = signal
+        self.predicate = predicate
+        self.timeout = timeout
+
+
+class _ParkedProcess(object):
+    def __init__(self, clock, gen, predicate):
+        self.clock = clock
+        self.gen = gen
+        self.predicate = predicate
+        self.done = False
+
+    # 条件成立时被通知, 或者超时(不检查条件), 只恢复一次
+    def wake(self):
+        if self.done:
+            return
+        self.done = True
+        self.clock.schedule(0, self.clock._resume, self.gen)
+
+
+def _idle():
+    pass
+
+
+class WallClock(object):
+    def now(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def process(self, gen):
+        # 在调用线程中同步执行, 直到生成器结束
+        for delay in gen:
+            if isinstance(delay, Wait):
+                delay.signal.wait(delay.predicate, delay.timeout)
+            else:
+                self.sleep(delay)
+
+
+class EventClock(object):
+    def __init__(self, start=0.0):
+        self._now = start
+        self._events = []  # (time, seq, callback, args)
+        self._seq = 0  # 同一时刻的事件按加入顺序执行
+        self.event_counter = 0
+
+    def now(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float):
+        raise RuntimeError("EventClock cannot block, yield the delay from a process instead")
+
+    def schedule(self, delay: float, callback, *args):
+        self.schedule_at(self._now + max(delay, 0), callback, *args)
+
+    def schedule_at(self, at: float, callback, *args):
+        heapq.heappush(self._events, (at, self._seq, callback, args))
+        self._seq += 1
+
+    def process(self, gen):
+        # 注册一个进程, 在当前时刻开始执行
+        self.schedule(0, self._resume, gen)
+
+    def process_at(self, at: float, gen):
+        # 注册一个进程, 在 at 时刻开始执行, 用于从检查点恢复
+        self.schedule_at(at, self._resume, gen)
+
+    def process_now(self, gen):
+        # 立即执行到第一次 yield, 不计为事件. 用于从检查点恢复等待条件(Wait)的进程:
+        # 重新进入的循环只是再次挂起, 原来的运行中这一步不是事件
+        self._resume(gen)
+
+    def _resume(self, gen):
+        try:
+            delay = next(gen)
+        except StopIteration:
+            return
+        if isinstance(delay, Wait):
+            self._wait(gen, delay)
+        else:
+            self.schedule(delay, self._resume, gen)
+
+    def _wait(self, gen, wait: Wait):
+        if wait.predicate():
+            self.schedule(0, self._resume, gen)
+            return
+        waiter = _ParkedProcess(self, gen, wait.predicate)
+        wait.signal.parked.append(waiter)
+        if wait.timeout is not None:
+            self.schedule(wait.timeout, waiter.wake)
+
+    def run(self, until=None) -> int:
+        # 依次执行事件直到事件队列为空或者到达 until, 返回执行的事件数
+        counter = 0
+        events = self._events
+        while events:
+            if until is not None and events[0][0] > until:
+                break
+            at, _, callback, args = heapq.heappop(events)
+            self._now = at
+            callback(*args)
+            counter += 1
+        if until is not None and self._now < until:
+            self._now = until
+        self.event_counter += counter
+        return counter
+
+    # 检查点: 等待进程被通知唤醒后, 它的超时事件仍留在事件队列中, 到时不做任何事但计为一个事件.
+    # 保存这些事件的时间, 恢复后重新加入, 使恢复后的事件数与不中断运行时相同
+    def idle_timeouts(self) -> list:
+        return sorted(at for at, _, callback, args in self._events
+                      if isinstance(getattr(callback, '__self__', None), _ParkedProcess) and callback.__self__.done)
+
+    def schedule_idle(self, times):
+        for at in times:
+            self.schedule_at(at, _idle)
+
+    def pending(self) -> int:
+        return len(self._events)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+路口状态的推送流, 由 WebServer 的 /stream 接口以 SSE 或者 NDJSON 输出
+只有一个生产者(交通管理线程/web 注册)更新当前状态并把版本号加一, 每个订阅者在自己的线程中等待版本变化,
+与上一次发送的状态比较后只发送变化的部分. 唤醒所有订阅者(notify_all)的开销与订阅者数量成正比,
+由后台的广播线程完成, 发布方只在锁内更新状态, 开销与订阅者数量无关;
+慢的订阅者不会积压消息, 醒来时直接取最新状态, 中间的变化合并为一次
+"""
+
+import threading
+import time
+
+
+class StateStream(object):
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.version = 0
+        self.queues = [0] * 8  # 8 条等待队列的长度
+        self.phase = []  # 当前放行的队列, 空表示黄灯/全红
+        self.subscribers = 0  # 没有订阅者时发布方可以跳过读取队列长度
+        self.changed = threading.Event()  # 通知广播线程状态有变化
+        self.broadcaster = None
+
+    # 广播线程: 等待发布, 唤醒所有订阅者. 期间的多次发布合并为一次唤醒
+    def _broadcast_loop(self):
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            with self.cond:
+                self.cond.notify_all()
+
+    def publish_queues(self, queue_sizes):
+        with self.cond:
+            if queue_sizes == self.queues:
+                return
+            self.queues = list(queue_sizes)
+            self.version += 1
+        self.changed.set()
+
+    def publish_phase(self, *args):
+        phase = [x for x in args if x is not None]
+        with self.cond:
+            if phase == self.phase:
+                return
+            self.phase = phase
+            self.version += 1
+        self.changed.set()
+
+    # 订阅, 依次返回 dict: 第一条为完整状态 snapshot, 之后为变化 delta(只包含变化的队列/相位);
+    # heartbeat 秒内没有变化时返回 None, 调用方可以发送心跳以检测断开的连接.
+    # 没有订阅者时发布方不发布队列长度, 保存的状态可能已经过时: queue_sizes 为读取当前队列长度的函数,
+    # 登记订阅者之后、取完整状态之前调用一次, 之后的变化都会被发布
+    def subscribe(self, heartbeat=15.0, queue_sizes=None):
+        with self.cond:
+            self.subscribers += 1
+            if self.broadcaster is None:
+                self.broadcaster = threading.Thread(target=self._broadcast_loop, daemon=True)
+                self.broadcaster.start()
+        try:
+            if queue_sizes is not None:
+                self.publish_queues(queue_sizes())
+            with self.cond:
+                version, queues, phase = self.version, list(self.queues), list(self.phase)
+            yield {"type": "snapshot", "version": version, "time": time.time(), "queues": queues, "phase": phase}
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.version != version, heartbeat):
+                        new_queues = None
+                    else:
+                        version, new_queues, new_phase = self.version, self.queues, self.phase
+                if new_queues is None:
+                    yield None
+                    continue
+                event = {"type": "delta", "version": version, "time": time.time()}
+                changed = {str(i): n for i, (n, old) in enumerate(zip(new_queues, queues)) if n != old}
+                if changed:
+                    event["queues"] = changed
+                if new_phase != phase:
+                    event["phase"] = new_phase
+                queues, phase = new_queues, new_phase
+                if changed or "phase" in event:
+                    yield event
+        finally:
+            with self.cond:
+                self.subscribers -= 1
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+红绿灯时间参数扫描: 对 GREEN_DELAY_TIME, YELLOW_DELAY_TIME, STRAIGHT_PASS_TIME, APPEND_TIME
+做网格搜索或随机搜索, 每组参数在多个随机种子下以离散事件模式运行(无界面),
+所有 (参数, 种子) 组合分发到进程池并行执行, 按参数汇总吞吐量与等待时间
+
+    python sweep.py --policy normal --scenario balanced --green 2 3 4 6 --append 0.1 0.2
+    python sweep.py --policy pressure --random 64 --seeds 1 2 3 --top 10
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import random
+import time
+
+from bench_policies import SCENARIOS
+from scheduler_server import (Controller, EventClock, TRAFFIC_MANAGERS, GREEN_DELAY_TIME, YELLOW_DELAY_TIME,
+                              STRAIGHT_PASS_TIME, APPEND_TIME)
+
+# 参数名 -> 交通管理器上对应的属性(不同策略使用的属性不同, 没有的属性忽略)
+PARAMETERS = {"green": ("green_delay_time", "max_green_time"),
+              "yellow": ("yellow_delay_time",),
+              "pass": ("pass_time",),
+              "append": ("append_time",)}
+
+DEFAULTS = {"green": GREEN_DELAY_TIME,
+            "yellow": YELLOW_DELAY_TIME,
+            "pass": STRAIGHT_PASS_TIME,
+            "append": APPEND_TIME}
+
+# 随机搜索时每个参数的取值范围
+RANGES = {"green": (1.0, 10.0),
+          "yellow": (0.1, 1.0),
+          "pass": (0.1, 1.0),
+          "append": (0.05, 0.5)}
+
+
+def run_config(task) -> tuple:
+    # 在子进程中执行, 参数和结果都需要能被 pickle
+    policy, rates, duration, config, seed = task
+    controller = Controller(None, clock=EventClock(), policy=policy, web=False)
+    for name, value in config:
+        for attr in PARAMETERS[name]:
+            if hasattr(controller.traffic_manager, attr):
+                setattr(controller.traffic_manager, attr, value)
+    res = controller.simulate(duration, arrival_rate=rates, seed=seed, verbose=False)
+    return config, res
+
+
+def grid_configs(values: dict) -> list:
+    names = sorted(values.keys())
+    return [tuple(zip(names, combination)) for combination in itertools.product(*(values[n] for n in names))]
+
+
+def random_configs(n, seed=None) -> list:
+    rand = random.Random(seed)
+    names = sorted(RANGES.keys())
+    return [tuple((name, round(rand.uniform(*RANGES[name]), 3)) for name in names) for i in range(n)]
+
+
+# 多个随机种子的结果取平均, 最大等待时间取最大值
+def aggregate(results) -> list:
+    grouped = {}
+    for config, res in results:
+        grouped.setdefault(config, []).append(res)
+    rows = []
+    for config, group in grouped.items():
+        rows.append({"config": dict(config),
+                     "throughput": sum(r["throughput"] for r in group) / len(group),
+                     "mean_delay": sum(r["mean_delay"] for r in group) / len(group),
+                     "p95_delay": sum(r["p95_delay"] for r in group) / len(group),
+                     "max_delay": max(r["max_delay"] for r in group)})
+    rows.sort(key=lambda row: row["mean_delay"])
+    return rows
+
+
+def sweep(policy, rates, duration, configs, seeds, processes=None) -> list:
+    tasks = [(policy, rates, duration, config, seed) for config in configs for seed in seeds]
+    with multiprocessing.Pool(processes) as pool:
+        # 每个任务是一整段模拟, 耗时远大于进程间通信, chunksize 取 1 以便均匀分配
+        results = pool.imap_unordered(run_config, tasks, chunksize=1)
+        return aggregate(results)
+
+
+def main(policy, scenario, duration, configs, seeds, processes, top):
+    processes = processes or multiprocessing.cpu_count()
+    print("policy: {}, scenario: {}, duration: {}s, seeds: {}".format(policy, scenario, duration, list(seeds)))
+    print("{} configurations x {} seeds on {} processes".format(len(configs), len(seeds), processes))
+    start = time.time()
+    rows = sweep(policy, SCENARIOS[scenario], duration, configs, seeds, processes)
+    cost = time.time() - start
+
+    print("{:>7} {:>7} {:>7} {:>7} {:>12} {:>12} {:>12} {:>12}".format(
+        "green", "yellow", "pass", "append", "cars/s", "mean delay", "p95 delay", "max delay"))
+    for row in rows[:top]:
+        config = dict(DEFAULTS, **row["config"])
+        print("{:>7.2f} {:>7.2f} {:>7.2f} {:>7.2f} {:>12.3f} {:>11.2f}s {:>11.2f}s {:>11.2f}s".format(
+            config["green"], config["yellow"], config["pass"], config["append"],
+            row["throughput"], row["mean_delay"], row["p95_delay"], row["max_delay"]))
+    print("{} simulations in {:.1f}s".format(len(configs) * len(seeds), cost))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--policy', default="normal", choices=sorted(TRAFFIC_MANAGERS.keys()))
+    parser.add_argument('--scenario', default="balanced", choices=list(SCENARIOS.keys()))
+    parser.add_argument('--duration', type=float, default=3600)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2, 3])
+    for name in sorted(PARAMETERS.keys()):
+        parser.add_argument('--' + name, type=float, nargs='+', default=[DEFAULTS[name]])
+    parser.add_argument('--random', type=int, default=0,
+                        help="random search over this many configurations instead of the grid")
+    parser.add_argument('--random-seed', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None, help="default: number of cores")
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.random:
+        configs = random_configs(args.random, seed=args.random_seed)
+    else:
+        configs = grid_configs({name: getattr(args, name) for name in PARAMETERS})
+    main(args.policy, args.scenario, args.duration, configs, args.seeds, args.processes, args.top)
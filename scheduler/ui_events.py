@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*-coding:utf-8-*-
+
+"""
+交通管理线程与界面之间的状态事件队列
+Controller 在管理线程中发布队列长度/红绿灯的变化, 只做一次加锁赋值, 不做任何 pygame 操作;
+界面的渲染循环每帧取出一次并更新精灵. 界面每帧只需要最新的状态, 所以同类事件会合并:
+队列中最多保存一份队列长度和一份红绿灯状态, 渲染变慢时不会积压, 也不会拖慢调度
+"""
+
+import threading
+
+_EMPTY = object()
+
+
+class UIEventQueue(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue_sizes = None  # 最新的 8 条队列长度
+        self.light = _EMPTY  # 最新的红绿灯状态(on_traffic_light_changed 的参数)
+        self.published = 0
+        self.coalesced = 0  # 被后来的事件覆盖, 没有被界面取出的事件数
+
+    def publish_queue(self, queue_sizes):
+        with self.lock:
+            if self.queue_sizes is not None:
+                self.coalesced += 1
+            self.queue_sizes = queue_sizes
+            self.published += 1
+
+    def publish_light(self, *args):
+        with self.lock:
+            if self.light is not _EMPTY:
+                self.coalesced += 1
+            self.light = args
+            self.published += 1
+
+    # 取出并清空, 返回 (queue_sizes, light), 没有新事件的一项为 None
+    def drain(self):
+        with self.lock:
+            queue_sizes, light = self.queue_sizes, self.light
+            self.queue_sizes, self.light = None, _EMPTY
+        return queue_sizes, (None if light is _EMPTY else light)